@@ -1,13 +1,17 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional
 import unicodedata
 
-import requests
 import typer
-from github import Github
-from github.NamedUser import NamedUser
 
-from src.bitbucket import BitbucketExport
+from src.transport import DEFAULT_POOL_SIZE, create_session
+from src.user_cache import UserDirectoryCache
+from src.user_matching import match_users
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+USERS_CACHE_FILE = os.path.join(ROOT, "migration_data", "users-cache.json")
 
 
 def clean_up_name(name: str, prefixes: Optional[List[str]], suffixes: Optional[List[str]], remove_spaces: bool = False):
@@ -48,7 +52,7 @@ class UserName:
 
 @dataclass
 class GitHubUser:
-    gh_user: NamedUser
+    raw: Dict[str, Any]
     names: List[UserName]
     taken: bool = False
 
@@ -60,7 +64,7 @@ class GitHubUser:
 
     @property
     def login(self) -> str:
-        return self.gh_user.login
+        return self.raw["login"]
 
 
 @dataclass
@@ -68,6 +72,8 @@ class BitbucketUser:
     raw: Dict[str, Any]
     names: List[UserName]
     matching_gh_user: Optional[GitHubUser] = None
+    # 1 for equal names, below for approximate matches
+    match_score: float = 1.0
 
     def __hash__(self):
         return self.nickname.__hash__()
@@ -99,16 +105,34 @@ def main(
     ),
     jira_username: str = typer.Option(None),
     jira_password: str = typer.Option(None),
+    fuzzy_threshold: float = typer.Option(
+        1.0,
+        help=(
+            "Minimum similarity (0 to 1) of the names of users matched approximately. 1 only matches equal names. "
+            "Approximate matches are commented out in the mapping, to be reviewed"
+        ),
+    ),
+    concurrency: int = typer.Option(DEFAULT_POOL_SIZE, help="Concurrent Jira requests"),
+    cache_file: str = typer.Option(
+        USERS_CACHE_FILE, help="JSON file where downloaded users are kept, to run the mapping again without downloading"
+    ),
+    cache_ttl_hours: float = typer.Option(24, help="Users downloaded more than this number of hours ago are refreshed"),
 ):
+    # Imported once the options are parsed, so that --help and invalid options do not wait for them
+    from src.bitbucket import BitbucketExport
+    from src.github import get_organization_members
 
-    github = Github(github_access_token, timeout=30, retry=3, per_page=100)
+    cache = UserDirectoryCache(cache_file, cache_ttl_hours * 3600)
 
     print(f"Getting GitHub org {github_org} members")
-    gh_org_members = github.get_organization(github_org).get_members()
+    gh_org_members = cache.get_or_fetch(
+        f"github:{github_org}", lambda: get_organization_members(github_access_token, github_org)
+    )
+    print(f"Got {len(gh_org_members)} GitHub users")
 
     bitbucket = BitbucketExport(team_name=bitbucket_team, username=bitbucket_username, app_password=bitbucket_password)
     print(f"Getting Bitbucket team {bitbucket_team} members")
-    bb_users_raw = bitbucket.get_team_users()
+    bb_users_raw = cache.get_or_fetch(f"bitbucket:{bitbucket_team}", bitbucket.get_team_users)
     print(f"Got {len(bb_users_raw)} Bitbucket users")
 
     bb_users: List[BitbucketUser] = []
@@ -132,97 +156,84 @@ def main(
 
     if jira_url and jira_username and jira_password:
         print(f"Getting details about Bitbucket users using Jira API")
-        for i, bb_user in enumerate(bb_users):
-            if (i + 1) % 10 == 0:
-                print(f"{i + 1}...")
+        jira_session = create_session(pool_size=concurrency, auth=(jira_username, jira_password))
+
+        def get_jira_user(bb_user: BitbucketUser) -> Optional[Dict[str, Any]]:
             bb_account_id = bb_user.raw.get("account_id")
             if not bb_account_id:
-                continue
-            jira_response = requests.get(
-                f"{jira_url}/rest/api/3/user", params={"accountId": bb_account_id}, auth=(jira_username, jira_password)
-            )
+                return None
+            if (jira_user := cache.get(f"jira:{bb_account_id}")) is not None:
+                return jira_user
+            jira_response = jira_session.get(f"{jira_url}/rest/api/3/user", params={"accountId": bb_account_id})
             if not jira_response.ok:
                 print(f"Warning: cannot get Jira user from Bitbucket user {bb_user.nickname}")
+                return None
+            jira_user = {key: jira_response.json().get(key) for key in ("emailAddress", "displayName")}
+            cache.set(f"jira:{bb_account_id}", jira_user)
+            return jira_user
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            jira_users = list(executor.map(get_jira_user, bb_users))
+        for bb_user, jira_user in zip(bb_users, jira_users):
+            if jira_user is None:
                 continue
-            if email := jira_response.json().get("emailAddress"):
+            if email := jira_user.get("emailAddress"):
                 bb_user.names.append(
                     UserName("Email (from Jira)", email, clean_up_name(email, user_prefix, user_suffix))
                 )
-            if display_name := jira_response.json().get("displayName"):
+            if display_name := jira_user.get("displayName"):
                 bb_user.names.append(
                     UserName(
                         "Display Name (from Jira)", display_name, clean_up_name(display_name, user_prefix, user_suffix)
                     )
                 )
-
-    print(f"Getting details about all GitHub {github_org} org members")
-    gh_detailed_org_members: List[NamedUser] = []
-    for i, gh_org_member in enumerate(gh_org_members):
-        if (i + 1) % 10 == 0:
-            print(f"{i + 1}...")
-        gh_detailed_org_members.append(github.get_user(gh_org_member.login))
-    print(f"Got {len(gh_detailed_org_members)} GitHub users")
+    cache.save()
 
     gh_users: List[GitHubUser] = []
-    for gh_detailed_org_member in gh_detailed_org_members:
+    for gh_org_member in gh_org_members:
         names: List[UserName] = []
-        if gh_detailed_org_member.login:
-            names.append(
-                UserName(
-                    "login",
-                    gh_detailed_org_member.login,
-                    clean_up_name(gh_detailed_org_member.login, user_prefix, user_suffix),
-                )
-            )
-        if gh_detailed_org_member.name:
-            names.append(
-                UserName(
-                    "name",
-                    gh_detailed_org_member.name,
-                    clean_up_name(gh_detailed_org_member.name, user_prefix, user_suffix),
-                )
-            )
-            names.append(
-                UserName(
-                    "name",
-                    gh_detailed_org_member.name,
-                    clean_up_name(gh_detailed_org_member.name, user_prefix, user_suffix, remove_spaces=True),
-                )
-            )
-        if gh_detailed_org_member.email:
-            names.append(
-                UserName(
-                    "name",
-                    gh_detailed_org_member.email,
-                    clean_up_name(gh_detailed_org_member.email, user_prefix, user_suffix),
-                )
-            )
-        gh_users.append(GitHubUser(gh_detailed_org_member, names))
-
+        if login := gh_org_member.get("login"):
+            names.append(UserName("login", login, clean_up_name(login, user_prefix, user_suffix)))
+        if name := gh_org_member.get("name"):
+            names.append(UserName("name", name, clean_up_name(name, user_prefix, user_suffix)))
+            names.append(UserName("name", name, clean_up_name(name, user_prefix, user_suffix, remove_spaces=True)))
+        if email := gh_org_member.get("email"):
+            names.append(UserName("name", email, clean_up_name(email, user_prefix, user_suffix)))
+        gh_users.append(GitHubUser(gh_org_member, names))
+
+    matches, ambiguous = match_users(
+        [[name.cleaned_up_name for name in bb_user.names] for bb_user in bb_users],
+        [[name.cleaned_up_name for name in gh_user.names] for gh_user in gh_users],
+        min_score=fuzzy_threshold,
+    )
+    for match in matches:
+        bb_user = bb_users[match.left]
+        gh_user = gh_users[match.right]
+        bb_name = bb_user.names[match.left_name]
+        gh_name = gh_user.names[match.right_name]
+        gh_user.taken = True
+        bb_user.matching_gh_user = gh_user
+        bb_user.match_score = match.score
+        print(
+            f"Matched Bitbucket user {bb_user} with GitHub user {gh_user} on Bitbucket "
+            f"{bb_name.name_type} ({bb_name.name}) to GitHub {gh_name.name_type} ({gh_name.name}), "
+            f"score {match.score:.2f}"
+        )
+    for left, rights in ambiguous.items():
+        candidates = ", ".join(gh_users[right].login for right in rights)
+        print(f"Ambiguous match for Bitbucket user {bb_users[left]}, map it by hand. Candidates: {candidates}")
     for bb_user in bb_users:
-        for gh_user in gh_users:
-            if gh_user.taken:
-                continue
-            for bb_name in bb_user.names:
-                for gh_name in gh_user.names:
-                    if bb_name.cleaned_up_name == gh_name.cleaned_up_name:
-                        gh_user.taken = True
-                        bb_user.matching_gh_user = gh_user
-                        print(
-                            f"Matched Bitbucket user {bb_user} with GitHub user {gh_user} on Bitbucket "
-                            f"{bb_name.name_type} ({bb_name.name}) to GitHub {gh_name.name_type} ({gh_name.name})"
-                        )
-                        break
-                if bb_user.matching_gh_user:
-                    break
-            if bb_user.matching_gh_user:
-                break
-        else:
+        if not bb_user.matching_gh_user:
             print(f"Unable to find GitHub user for Bitbucket user {bb_user}")
 
     print("\nUser mapping to copy to config.py:\nUSER_MAPPING: Dict[str, str] = {")
-    for bb_user in [user for user in bb_users if user.matching_gh_user]:
+    for bb_user in [user for user in bb_users if user.matching_gh_user and user.match_score >= 1]:
         print(f'    "{bb_user.nickname}": "{bb_user.matching_gh_user.login}",')
+    approximate_users = [user for user in bb_users if user.matching_gh_user and user.match_score < 1]
+    if approximate_users:
+        print("    # Approximate matches, uncomment the right ones after review")
+    for bb_user in approximate_users:
+        print(f'    # "{bb_user.nickname}": "{bb_user.matching_gh_user.login}",  score {bb_user.match_score:.2f}')
     print("}\n")
 
     print("Bitbucket orphan users:")
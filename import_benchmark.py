@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import os
+import statistics
+import subprocess
+import sys
+from typing import List, Optional, Tuple
+
+import typer
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+# Modules run from the command line, usually for short invocations (--help, plans, syncs)
+ENTRY_MODULES = ["main", "src.migrate_discussions", "find_users"]
+# Imported when a repository is migrated, they must not be imported by the command line modules
+HEAVY_MODULES = ["git", "github", "requests", "dateutil"]
+
+MEASURE_SCRIPT = """
+import sys, time
+started_at = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started_at
+print(elapsed, ",".join(name for name in {heavy_modules!r} if name in sys.modules), sep="|")
+"""
+
+
+def measure_import(module: str) -> Tuple[float, List[str]]:
+    """Import time of the module in a new interpreter, in seconds, and the heavy modules it imported"""
+    script = MEASURE_SCRIPT.format(module=module, heavy_modules=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True, capture_output=True, text=True)
+    elapsed, heavy_modules = output.stdout.splitlines()[-1].split("|")
+    return float(elapsed), [name for name in heavy_modules.split(",") if name]
+
+
+def main(
+    runs: int = typer.Option(5, help="Number of imports of each module, the median is reported"),
+    max_ms: Optional[float] = typer.Option(None, help="Fail when the median import time of a module is above this"),
+) -> None:
+    """
+    Measure the import time of the command line modules, and fail when they import the migration dependencies, or
+    take longer than --max-ms.
+    """
+    failures = []
+    for module in ENTRY_MODULES:
+        measures = [measure_import(module) for _ in range(runs)]
+        median_ms = statistics.median(elapsed for elapsed, _ in measures) * 1000
+        heavy_modules = measures[0][1]
+        print(f"{module:<30} {median_ms:7.1f} ms  heavy modules: {', '.join(heavy_modules) or 'none'}")
+        if heavy_modules:
+            failures.append(f"{module} imports {', '.join(heavy_modules)}")
+        if max_ms is not None and median_ms > max_ms:
+            failures.append(f"{module} takes {median_ms:.1f} ms to import, more than {max_ms} ms")
+
+    for failure in failures:
+        print(f"Error: {failure}")
+    if failures:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
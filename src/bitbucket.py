@@ -1,26 +1,107 @@
-from typing import Any, Dict, Iterator, List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
 import requests
-from requests import Session
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 
-from .utils import get_request_content, get_request_json
+from .concurrency import AimdLimiter
+from .records import BitbucketIssue, BitbucketPull
+from .transport import DEFAULT_POOL_SIZE, create_session
+from .utils import get_request_bytes, get_request_content, get_request_json, stream_paginated_values
 
+# Partial responses: only request the fields read by the construct_gh_* functions.
+# See https://developer.atlassian.com/cloud/bitbucket/rest/intro/#partial-response
+USER_FIELDS = ["nickname"]
+ISSUE_FIELDS = [
+    "id",
+    "title",
+    "content.raw",
+    "created_on",
+    "updated_on",
+    "state",
+    "kind",
+    "priority",
+    "component.name",
+    *(f"reporter.{field}" for field in USER_FIELDS),
+    *(f"assignee.{field}" for field in USER_FIELDS),
+]
+PULL_FIELDS = [
+    "id",
+    "title",
+    "description",
+    "created_on",
+    "updated_on",
+    "state",
+    "source.branch.name",
+    "source.commit.hash",
+    "source.repository.full_name",
+    "destination.branch.name",
+    "destination.commit.hash",
+    "destination.repository.full_name",
+    "merge_commit.hash",
+    "participants.role",
+    "participants.approved",
+    *(f"author.{field}" for field in USER_FIELDS),
+    *(f"participants.user.{field}" for field in USER_FIELDS),
+    *(f"reviewers.{field}" for field in USER_FIELDS),
+]
+COMMENT_FIELDS = [
+    "id",
+    "created_on",
+    "content.raw",
+    "deleted",
+    "inline",
+    "links.self.href",
+    "links.code.href",
+    *(f"user.{field}" for field in USER_FIELDS),
+]
+CHANGE_FIELDS = ["id", "created_on", "changes", *(f"user.{field}" for field in USER_FIELDS)]
+ACTIVITY_FIELDS = ["approval.date", *(f"approval.user.{field}" for field in USER_FIELDS)]
+ATTACHMENT_FIELDS = ["name"]
+REPOSITORY_FIELDS = ["full_name", "slug", "size", "has_issues"]
+UPDATED_FIELDS = ["id", "updated_on"]
 
-def get_paginated_json(url: str, session: requests.Session = None) -> Iterator[Dict[str, Any]]:
-    next_url = url
+FIELD_PROJECTIONS: Dict[str, List[str]] = {
+    "issue": ISSUE_FIELDS,
+    "issue_comment": COMMENT_FIELDS,
+    "issue_change": CHANGE_FIELDS,
+    "issue_attachment": ATTACHMENT_FIELDS,
+    "pull": PULL_FIELDS,
+    "pull_comment": COMMENT_FIELDS,
+    "pull_activity": ACTIVITY_FIELDS,
+    "repository": REPOSITORY_FIELDS,
+    "updated": UPDATED_FIELDS,
+}
+
+# The pull requests listing does not always contain these fields, the detailed pull request is then needed
+PULL_DETAIL_FIELDS = ("participants", "reviewers")
+PULLS_QUERY = "state=MERGED&state=SUPERSEDED&state=OPEN&state=DECLINED"
+# Maximum page length accepted by Bitbucket for pull requests
+PULLS_PAGE_LENGTH = 50
 
-    while next_url is not None:
-        result = get_request_json(next_url, session)
-        next_url = result.get("next", None)
-        for value in result["values"]:
-            yield value
+
+def add_query_params(url: str, params: Dict[str, str]) -> str:
+    parsed_url = urlparse(url)
+    query = parse_qsl(parsed_url.query) + list(params.items())
+    return urlunparse(parsed_url._replace(query=urlencode(query, safe=",.")))
+
+
+def get_paginated_json(url: str, session: requests.Session = None) -> Iterator[Dict[str, Any]]:
+    # Bitbucket keeps the query parameters, including the fields, in the "next" links
+    yield from stream_paginated_values(url, session)
 
 
 class BitbucketExport:
     def __init__(
-        self, repository_name: str = None, team_name: str = None, username: str = None, app_password: str = None
+        self,
+        repository_name: str = None,
+        team_name: str = None,
+        username: str = None,
+        app_password: str = None,
+        field_projection: bool = True,
+        max_workers: int = DEFAULT_POOL_SIZE,
+        limiter: Optional[AimdLimiter] = None,
     ):
         if repository_name and "/" in repository_name:
             self.team_name, self.short_repo_name = repository_name.split("/", maxsplit=1)
@@ -29,15 +110,33 @@ class BitbucketExport:
         else:
             self.short_repo_name = repository_name
             self.team_name = team_name
-        # Share TCP connection and add a delay between failing requests
-        session = Session()
-        if username is not None and app_password is not None:
-            session.auth = (username, app_password)
-        retry = Retry(total=10, connect=10, read=10, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504))
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
+        # Share TCP connections and add a delay between failing requests
+        auth = (username, app_password) if username is not None and app_password is not None else None
+        # The number of requests in flight adapts to Bitbucket's throttling, up to max_workers. A limiter shared by the
+        # clients of several repositories limits their requests together
+        self.limiter = limiter if limiter is not None else AimdLimiter(maximum=max_workers)
+        session = create_session(pool_size=max_workers, auth=auth, limiter=self.limiter)
+        # Count the requests sent to Bitbucket, for progress reporting
+        self.request_count = 0
+        # Responses are counted from the threads of the pipelines and of the executors
+        self._request_count_lock = threading.Lock()
+        session.hooks["response"].append(self._count_request)
         self.session = session
+        self.field_projection = field_projection
+        self.max_workers = max_workers
+
+    def _count_request(self, response: requests.Response, *args, **kwargs) -> None:
+        with self._request_count_lock:
+            self.request_count += 1
+
+    def project(self, url: str, profile: str, paginated: bool = False) -> str:
+        """Restrict the response of url to the fields of the projection profile"""
+        if not self.field_projection:
+            return url
+        fields = FIELD_PROJECTIONS[profile]
+        if paginated:
+            fields = ["next", *(f"values.{field}" for field in fields)]
+        return add_query_params(url, {"fields": ",".join(fields)})
 
     @property
     def repo_url(self) -> Optional[str]:
@@ -60,11 +159,16 @@ class BitbucketExport:
         repository = get_request_json(self.repo_url, self.session)
         return repository.get("mainbranch", {}).get("name")
 
-    def get_issues(self) -> List[Dict[str, Any]]:
+    def get_issues(self) -> List[BitbucketIssue]:
         print("Get all bitbucket issues...")
         try:
-            issues = list(get_paginated_json(self.repo_url + "/issues", self.session))
-            issues.sort(key=lambda x: x["id"])
+            issues = [
+                BitbucketIssue.from_json(issue)
+                for issue in get_paginated_json(
+                    self.project(self.repo_url + "/issues", "issue", paginated=True), self.session
+                )
+            ]
+            issues.sort(key=lambda x: x.id)
         except requests.exceptions.HTTPError as r:
             if r.response.status_code == 404:
                 print("Issues not activated for this repo, skipping")
@@ -72,16 +176,72 @@ class BitbucketExport:
             raise r
         return issues
 
+    def get_issue(self, issue_id: int) -> Optional[BitbucketIssue]:
+        try:
+            issue = get_request_json(self.project(self.repo_url + "/issues/" + str(issue_id), "issue"), self.session)
+            return BitbucketIssue.from_json(issue)
+        except requests.exceptions.HTTPError as r:
+            if r.response.status_code == 404:
+                print(f"Warning: Bitbucket issue #{issue_id} does not exist, skipping")
+                return None
+            raise r
+
+    def get_specific_issues(self, issue_ids: List[int]) -> List[BitbucketIssue]:
+        print("Getting specific Bitbucket issues")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            issues = [issue for issue in executor.map(self.get_issue, sorted(issue_ids)) if issue is not None]
+        return issues
+
+    def get_updated_since(self, url: str, since: str, since_id: int, limit: int) -> List[Dict[str, Any]]:
+        """
+        Ids and update dates of the first limit items of url after the (since, since_id) cursor, by update date then id.
+        Bitbucket sorts by update date only, so all the items of the last update date are read before sorting them by
+        id: the items cut by the limit are then all after the cursor of the last returned item.
+        """
+        url = add_query_params(url, {"q": f"updated_on >= {since}", "sort": "updated_on"})
+        items: List[Dict[str, Any]] = []
+        # Only the needed pages are requested
+        for item in get_paginated_json(self.project(url, "updated", paginated=True), self.session):
+            if (item["updated_on"], item["id"]) <= (since, since_id):
+                continue
+            if len(items) >= limit and item["updated_on"] != items[-1]["updated_on"]:
+                break
+            items.append(item)
+        return sorted(items, key=lambda item: (item["updated_on"], item["id"]))[:limit]
+
+    def get_issues_updated_since(self, since: str, since_id: int, limit: int) -> List[Dict[str, Any]]:
+        try:
+            return self.get_updated_since(self.repo_url + "/issues", since, since_id, limit)
+        except requests.exceptions.HTTPError as r:
+            if r.response.status_code == 404:
+                # Issues not activated for this repo
+                return []
+            raise r
+
+    def get_pulls_updated_since(self, since: str, since_id: int, limit: int) -> List[Dict[str, Any]]:
+        url = self.repo_url + f"/pullrequests?{PULLS_QUERY}&pagelen={PULLS_PAGE_LENGTH}"
+        return self.get_updated_since(url, since, since_id, limit)
+
     def get_issue_comments(self, issue_id: int) -> Dict[int, List[Dict[str, Any]]]:
         if issue_id == 0:
             return {}
-        comments = list(get_paginated_json(self.repo_url + "/issues/" + str(issue_id) + "/comments", self.session))
+        comments = list(
+            get_paginated_json(
+                self.project(self.repo_url + "/issues/" + str(issue_id) + "/comments", "issue_comment", paginated=True),
+                self.session,
+            )
+        )
         return {comment["id"]: comment for comment in comments}
 
     def get_issue_changes(self, issue_id: int) -> List[Dict[str, Any]]:
         if issue_id == 0:
             return []
-        changes = list(get_paginated_json(self.repo_url + "/issues/" + str(issue_id) + "/changes", self.session))
+        changes = list(
+            get_paginated_json(
+                self.project(self.repo_url + "/issues/" + str(issue_id) + "/changes", "issue_change", paginated=True),
+                self.session,
+            )
+        )
         changes.sort(key=lambda x: x["id"])
         return changes
 
@@ -89,7 +249,10 @@ class BitbucketExport:
         if issue_id == 0:
             return {}
         attachments_query = get_paginated_json(
-            self.repo_url + "/issues/" + str(issue_id) + "/attachments", self.session
+            self.project(
+                self.repo_url + "/issues/" + str(issue_id) + "/attachments", "issue_attachment", paginated=True
+            ),
+            self.session,
         )
         attachments = {attachment["name"]: attachment for attachment in attachments_query}
         return attachments
@@ -100,52 +263,106 @@ class BitbucketExport:
         )
         return data
 
+    def get_issue_attachment_bytes(self, issue_id: int, attachment_name: str) -> bytes:
+        return get_request_bytes(
+            self.repo_url + "/issues/" + str(issue_id) + "/attachments/" + attachment_name, self.session
+        )
+
     def get_simplified_pulls(self) -> List[Dict[str, Any]]:
         print("Get all simplified bitbucket pull requests...")
         pulls = list(
-            get_paginated_json(
-                self.repo_url + "/pullrequests?state=MERGED&state=SUPERSEDED&state=OPEN&state=DECLINED", self.session
-            )
+            get_paginated_json(self.repo_url + f"/pullrequests?{PULLS_QUERY}&pagelen={PULLS_PAGE_LENGTH}", self.session)
         )
         pulls.sort(key=lambda x: x["id"])
         return pulls
 
+    def get_listed_pulls(self) -> List[BitbucketPull]:
+        print("Get all bitbucket pull requests...")
+        url = self.project(
+            self.repo_url + f"/pullrequests?{PULLS_QUERY}&pagelen={PULLS_PAGE_LENGTH}", "pull", paginated=True
+        )
+        pulls = [BitbucketPull.from_json(pull) for pull in get_paginated_json(url, self.session)]
+        pulls.sort(key=lambda x: x.id)
+        return pulls
+
     def get_team_users(self) -> List[Dict[str, Any]]:
         return list(get_paginated_json(self.team_url + "/members", self.session))
 
-    def get_pulls_count(self) -> int:
-        pulls_page = get_request_json(
-            self.repo_url + "/pullrequests?state=MERGED&state=SUPERSEDED&state=OPEN&state=DECLINED", self.session
+    def get_team_repositories(self) -> List[Dict[str, Any]]:
+        print(f"Get all bitbucket repositories of {self.team_name}...")
+        url = self.project(
+            f"https://api.bitbucket.org/2.0/repositories/{self.team_name}?pagelen=100", "repository", paginated=True
         )
+        repositories = list(get_paginated_json(url, self.session))
+        repositories.sort(key=lambda x: x["full_name"])
+        return repositories
+
+    def get_issues_count(self) -> int:
+        try:
+            issues_page = get_request_json(self.repo_url + "/issues?pagelen=1&fields=size", self.session)
+        except requests.exceptions.HTTPError as r:
+            if r.response.status_code == 404:
+                # Issues not activated for this repo
+                return 0
+            raise r
+        return issues_page["size"]
+
+    def get_pulls_count(self) -> int:
+        pulls_page = get_request_json(self.repo_url + f"/pullrequests?{PULLS_QUERY}&pagelen=1", self.session)
         return pulls_page["size"]
 
-    def get_pull(self, pull_id: int) -> Dict[str, Any]:
-        pull = get_request_json(self.repo_url + "/pullrequests/" + str(pull_id), self.session)
-        return pull
+    def get_pull(self, pull_id: int) -> BitbucketPull:
+        pull = get_request_json(self.project(self.repo_url + "/pullrequests/" + str(pull_id), "pull"), self.session)
+        return BitbucketPull.from_json(pull)
 
-    def get_pulls(self, pulls_to_get: Optional[List[int]]) -> Iterator[Dict[str, Any]]:
+    def complete_pull(self, pull: BitbucketPull) -> BitbucketPull:
+        if all(getattr(pull, field) is not None for field in PULL_DETAIL_FIELDS):
+            return pull
+        return self.get_pull(pull.id)
+
+    def complete_pulls(self, pulls: List[BitbucketPull]) -> Iterator[BitbucketPull]:
+        """The listed pull requests with their missing details, fetched concurrently while keeping them in order"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            yield from executor.map(self.complete_pull, pulls)
+
+    def get_pulls(
+        self, pulls_to_get: Optional[List[int]], key: Optional[Callable[[BitbucketPull], Any]] = None
+    ) -> Iterator[BitbucketPull]:
+        """The pull requests by id, or sorted by key"""
         if not pulls_to_get:
-            pulls_count = self.get_pulls_count()
-            print(f"Get all {pulls_count} detailed Bitbucket pull requests...")
-            for pull_id in range(1, pulls_count + 1):
-                print(f"{pull_id}/{pulls_count}...")
-                yield self.get_pull(pull_id)
+            pulls = self.get_listed_pulls()
+            print(f"Got {len(pulls)} Bitbucket pull requests")
+            if key is not None:
+                # The listing has the fields of the key
+                pulls.sort(key=key)
+            yield from self.complete_pulls(pulls)
         else:
             print(f"Getting specific Bitbucket pull requests")
-            for pull_id in pulls_to_get:
-                yield self.get_pull(pull_id)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                specific_pulls = executor.map(self.get_pull, pulls_to_get)
+                yield from sorted(specific_pulls, key=key) if key is not None else specific_pulls
 
     def get_pull_comments(self, pulls_id: int) -> Dict[int, List[Dict[str, Any]]]:
         comments = list(
-            get_paginated_json(self.repo_url + "/pullrequests/" + str(pulls_id) + "/comments", self.session)
+            get_paginated_json(
+                self.project(
+                    self.repo_url + "/pullrequests/" + str(pulls_id) + "/comments", "pull_comment", paginated=True
+                ),
+                self.session,
+            )
         )
         return {comment["id"]: comment for comment in comments}
 
     def get_pull_activity(self, pulls_id: int) -> List[Dict[str, Any]]:
         activity = list(
-            get_paginated_json(self.repo_url + "/pullrequests/" + str(pulls_id) + "/activity", self.session)
+            get_paginated_json(
+                self.project(
+                    self.repo_url + "/pullrequests/" + str(pulls_id) + "/activity", "pull_activity", paginated=True
+                ),
+                self.session,
+            )
         )
         return activity
 
     def get_detailed_comment(self, shallow_comment: Dict[str, Any]) -> Dict[str, Any]:
-        return get_request_json(shallow_comment["links"]["self"]["href"], self.session)
+        return get_request_json(self.project(shallow_comment["links"]["self"]["href"], "pull_comment"), self.session)
@@ -0,0 +1,51 @@
+from enum import Enum
+from typing import Dict, List, Tuple
+
+# GitHub rejects comments longer than this
+GITHUB_MAX_COMMENT_SIZE = 65536
+
+# Between merged events, continues their quote
+EVENTS_SEPARATOR = "\n>\n"
+COMMENTS_SEPARATOR = "\n\n---\n\n"
+
+
+class CommentCompaction(str, Enum):
+    # One GitHub comment per Bitbucket comment, change and activity
+    none = "none"
+    # Consecutive changes and activities are merged in one comment
+    events = "events"
+    # Consecutive comments of any kind are merged, up to the size of a GitHub comment
+    all = "all"
+
+
+def compact_comments(
+    comments: List[Dict[str, str]],
+    events: List[Dict[str, str]],
+    compaction: CommentCompaction = CommentCompaction.none,
+    max_size: int = GITHUB_MAX_COMMENT_SIZE,
+) -> List[Dict[str, str]]:
+    """
+    Sort the comments and the events (changes of an issue, activity of a pull request) by date, and merge them
+    according to compaction. A merged comment keeps the date of its first entry, so the chronology is kept.
+    Each GitHub comment is a separate write outside the import API, merging them saves as many calls.
+    """
+    entries: List[Tuple[Dict[str, str], bool]] = [(comment, False) for comment in comments]
+    entries += [(event, True) for event in events]
+    # Stable sort, comments stay before events at the same date
+    entries.sort(key=lambda entry: entry[0]["created_at"])
+    if compaction == CommentCompaction.none:
+        return [comment for comment, _ in entries]
+
+    merged: List[Dict[str, str]] = []
+    previous_is_event = False
+    for comment, is_event in entries:
+        both_events = is_event and previous_is_event
+        separator = EVENTS_SEPARATOR if both_events else COMMENTS_SEPARATOR
+        mergeable = merged and (both_events or compaction == CommentCompaction.all)
+        body = merged[-1]["body"].rstrip("\n") + separator + comment["body"] if mergeable else ""
+        if mergeable and len(body) <= max_size:
+            merged[-1] = {"body": body, "created_at": merged[-1]["created_at"]}
+        else:
+            merged.append(dict(comment))
+        previous_is_event = is_event
+    return merged
@@ -0,0 +1,128 @@
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def parse_retry_after(response: requests.Response) -> Optional[float]:
+    """Delay in seconds from the Retry-After header, which holds either seconds or an HTTP date"""
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AimdLimiter:
+    """
+    Limit the number of requests in flight, with additive increase and multiplicative decrease (AIMD).
+    The limit grows while responses are successful and their latency stays close to the best observed latency.
+    It is cut when the server throttles (429) or fails (5xx), and requests are paused for the Retry-After delay.
+    """
+
+    def __init__(
+        self,
+        maximum: int,
+        minimum: int = 1,
+        initial: Optional[int] = None,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+    ):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(initial or max(minimum, maximum // 2))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.min_latency: Optional[float] = None
+        self.last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def on_success(self, latency: float) -> None:
+        with self._condition:
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+            if latency <= self.latency_tolerance * self.min_latency:
+                # About one more request in flight once a whole window of requests succeeded
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+                self._condition.notify_all()
+
+    def on_throttled(self, status_code: int, retry_after: Optional[float]) -> None:
+        with self._condition:
+            now = time.monotonic()
+            # Requests in flight during a throttling all fail together, only decrease once for them
+            if now - self.last_decrease > (self.min_latency or 1.0):
+                self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+                self.last_decrease = now
+                print(f"Warning: Bitbucket answered {status_code}, limiting to {int(self.limit)} requests in flight")
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+
+class AdaptiveHTTPAdapter(HTTPAdapter):
+    """
+    Send requests through an AimdLimiter.
+    Throttled and failed responses are retried here instead of in urllib3, so that the limiter sees each of them.
+    """
+
+    def __init__(
+        self,
+        limiter: AimdLimiter,
+        retry_statuses: tuple,
+        max_status_retries: int = 10,
+        backoff_factor: float = 0.3,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.limiter = limiter
+        self.retry_statuses = retry_statuses
+        self.max_status_retries = max_status_retries
+        self.backoff_factor = backoff_factor
+
+    def send(self, request, **kwargs):
+        for attempt in range(self.max_status_retries + 1):
+            with self.limiter.slot():
+                start = time.monotonic()
+                response = super().send(request, **kwargs)
+                latency = time.monotonic() - start
+            if response.status_code not in self.retry_statuses:
+                self.limiter.on_success(latency)
+                return response
+
+            retry_after = parse_retry_after(response)
+            self.limiter.on_throttled(response.status_code, retry_after)
+            if attempt == self.max_status_retries:
+                return response
+            response.close()
+            if retry_after is None:
+                time.sleep(self.backoff_factor * (2**attempt))
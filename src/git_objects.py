@@ -0,0 +1,66 @@
+import re
+import threading
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from git import Git, Repo
+
+HASH_PATTERN = re.compile(r"[0-9a-f]{4,40}")
+BRANCH_REF_PREFIX = "refs/heads/"
+
+
+class GitObjectIndex:
+    """
+    Resolve commits and files in a local clone of the repository, instead of requesting GitHub for each of them.
+    GitPython keeps a single `git cat-file --batch-check` process open for all the lookups, and the results are kept
+    in memory, as many inline comments point to the same commits and files.
+    """
+
+    def __init__(self, path: str):
+        self.repo = Repo(path)
+        self.commits: Dict[str, Optional[str]] = {}
+        self.files: Dict[Tuple[str, str], bool] = {}
+        # The batch process answers one lookup at a time
+        self._lock = threading.Lock()
+
+    def _get_object_type(self, ref: str) -> Optional[Tuple[str, str]]:
+        """Full hash and type of the object, None if it does not exist or is ambiguous"""
+        try:
+            hexsha, object_type, _ = self.repo.git.get_object_header(ref)
+        except ValueError:
+            return None
+        # GitPython returns the hash and the type as bytes
+        return hexsha.decode(), object_type.decode()
+
+    def resolve_commit(self, short_hash: str) -> Optional[str]:
+        """Full hash of the commit starting with short_hash"""
+        if not HASH_PATTERN.fullmatch(short_hash):
+            return None
+        with self._lock:
+            if short_hash not in self.commits:
+                header = self._get_object_type(f"{short_hash}^{{commit}}")
+                self.commits[short_hash] = header[0] if header else None
+            return self.commits[short_hash]
+
+    def has_file(self, commit: str, path: str) -> bool:
+        """Whether the file exists in the commit, given by its full hash"""
+        if "\n" in path:
+            return False
+        key = (commit, path)
+        with self._lock:
+            if key not in self.files:
+                header = self._get_object_type(f"{commit}:{path}")
+                self.files[key] = header is not None and header[1] == "blob"
+            return self.files[key]
+
+    def close(self) -> None:
+        self.repo.close()
+
+
+def list_remote_branches(url: str) -> FrozenSet[str]:
+    """Branches of a remote repository, listed with a single `git ls-remote`"""
+    branches = set()
+    for line in Git().ls_remote("--heads", url).splitlines():
+        _, ref = line.split("\t", 1)
+        if ref.startswith(BRANCH_REF_PREFIX):
+            branches.add(ref[len(BRANCH_REF_PREFIX) :])
+    return frozenset(branches)
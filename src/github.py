@@ -1,26 +1,197 @@
 from copy import deepcopy
 from time import sleep
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests
 from github import Github, enable_console_debug_logging
 from github.Gist import Gist
 from github.GithubException import UnknownObjectException
 from github.Issue import Issue
 from github.PullRequest import PullRequest
 from github.Repository import Repository
-from requests.packages.urllib3.util.retry import Retry
+from requests import Response, Session
 
+from .transport import DEFAULT_POOL_SIZE, create_retry, create_session
 from .utils import get_request_json
 
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+ORGANIZATION_MEMBERS_QUERY = """
+query($organization: String!, $after: String) {
+  organization(login: $organization) {
+    membersWithRole(first: 100, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes { login name email }
+    }
+  }
+}
+"""
+# Fields of the issues and pull requests compared by the verification, 50 items and their first 100 comments per call
+REPOSITORY_ITEMS_QUERY = """
+query($owner: String!, $name: String!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    %s(first: 50, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        number title body state createdAt
+        labels(first: 100) { nodes { name } }
+        comments(first: 100) { pageInfo { hasNextPage endCursor } nodes { body } }
+      }
+    }
+  }
+}
+"""
+ITEM_COMMENTS_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    issueOrPullRequest(number: $number) {
+      ... on Issue { comments(first: 100, after: $after) { pageInfo { hasNextPage endCursor } nodes { body } } }
+      ... on PullRequest { comments(first: 100, after: $after) { pageInfo { hasNextPage endCursor } nodes { body } } }
+    }
+  }
+}
+"""
+
+
+def create_github(access_token: str, pool_size: int = DEFAULT_POOL_SIZE) -> Github:
+    retry = create_retry(total=30, connect=5, read=5, backoff_factor=0.5)
+    return Github(access_token, timeout=30, retry=retry, per_page=100, pool_size=pool_size)
+
+
+def run_graphql_query(session: Session, access_token: str, query: str, variables: Dict[str, Any], what: str) -> Dict:
+    res = session.post(
+        GITHUB_GRAPHQL_URL,
+        json={"query": query, "variables": variables},
+        headers={"Authorization": f"bearer {access_token}"},
+    )
+    res.raise_for_status()
+    data = res.json()
+    if data.get("errors"):
+        raise Exception(f"Failed to get {what}: {data['errors']}")
+    return data["data"]
+
+
+def get_organization_members(access_token: str, organization: str, session: Optional[Session] = None) -> List[Dict]:
+    """
+    Login, name and email of all the members of an organization, with a GraphQL query returning 100 members per call.
+    The REST API needs a call per member for their name and email.
+    """
+    session = session or create_session()
+    members: List[Dict[str, Any]] = []
+    after = None
+    while True:
+        variables = {"organization": organization, "after": after}
+        data = run_graphql_query(
+            session,
+            access_token,
+            ORGANIZATION_MEMBERS_QUERY,
+            variables,
+            f"the members of the GitHub organization '{organization}'",
+        )
+        connection = data["organization"]["membersWithRole"]
+        members += connection["nodes"]
+        if not connection["pageInfo"]["hasNextPage"]:
+            return members
+        after = connection["pageInfo"]["endCursor"]
+
+
+def get_repository_items(
+    access_token: str, repository: str, session: Optional[Session] = None
+) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Issues and pull requests of a repository with their labels and comments, with GraphQL queries returning 50 items
+    per call. The REST API needs a call per item for its comments.
+    """
+    session = session or create_session()
+    owner, name = repository.split("/", 1)
+    results: Dict[str, List[Dict[str, Any]]] = {"issues": [], "pullRequests": []}
+    for connection_name, items in results.items():
+        query = REPOSITORY_ITEMS_QUERY % connection_name
+        after = None
+        while True:
+            variables = {"owner": owner, "name": name, "after": after}
+            data = run_graphql_query(session, access_token, query, variables, f"the {connection_name} of {repository}")
+            connection = data["repository"][connection_name]
+            items += connection["nodes"]
+            if not connection["pageInfo"]["hasNextPage"]:
+                break
+            after = connection["pageInfo"]["endCursor"]
+
+        # Items with more than 100 comments
+        for item in items:
+            comments = item["comments"]
+            while comments["pageInfo"]["hasNextPage"]:
+                variables = {"owner": owner, "name": name, "number": item["number"]}
+                variables["after"] = comments["pageInfo"]["endCursor"]
+                data = run_graphql_query(
+                    session,
+                    access_token,
+                    ITEM_COMMENTS_QUERY,
+                    variables,
+                    f"the comments of {repository}#{item['number']}",
+                )
+                page = data["repository"]["issueOrPullRequest"]["comments"]
+                comments["nodes"] += page["nodes"]
+                comments["pageInfo"] = page["pageInfo"]
+    return results["issues"], results["pullRequests"]
+
+
+class SessionRateLimit:
+    """Response hook keeping the rate limit headers of the last response of a session, which PyGithub does not see"""
+
+    def __init__(self) -> None:
+        self.status: Optional[Tuple[int, int, int]] = None
+
+    def __call__(self, response: Response, *args, **kwargs) -> None:
+        headers = response.headers
+        # GraphQL calls have their own budget
+        if "X-RateLimit-Remaining" not in headers or headers.get("X-RateLimit-Resource", "core") != "core":
+            return
+        self.status = (
+            int(headers["X-RateLimit-Remaining"]),
+            int(headers["X-RateLimit-Limit"]),
+            int(headers["X-RateLimit-Reset"]),
+        )
+
+
+def track_session_rate_limit(session: Session) -> SessionRateLimit:
+    """The rate limit hook of the session, added once when the session is shared by several imports"""
+    for hook in session.hooks["response"]:
+        if isinstance(hook, SessionRateLimit):
+            return hook
+    tracker = SessionRateLimit()
+    session.hooks["response"].append(tracker)
+    return tracker
+
 
 class GithubImport:
-    def __init__(self, access_token, repository, debug=False):
+    """
+    Writes are done with access_token, so that migrated content is authored by its user.
+    Reads are spread over access_token and read_tokens, picking the token with the largest remaining rate limit.
+    The github client, the session and the read_clients can be shared by the imports of several repositories, to reuse
+    their connections.
+    """
+
+    def __init__(
+        self,
+        access_token: str,
+        repository: str,
+        debug: bool = False,
+        github: Optional[Github] = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        read_tokens: Optional[List[str]] = None,
+        session: Optional[Session] = None,
+        read_clients: Optional[List[Github]] = None,
+    ):
         if debug:
             enable_console_debug_logging()
         self.access_token = access_token
-        retry = Retry(total=30, connect=5, read=5, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
-        self.github = Github(access_token, timeout=30, retry=retry, per_page=300)
+        self.github = github or create_github(access_token, pool_size)
+        self.read_clients: List[Github] = (
+            read_clients if read_clients is not None else [create_github(token, pool_size) for token in read_tokens or []]
+        )
+        # Used for the calls that PyGithub does not support. Authentication is set per request, so that the token
+        # is only sent to the API.
+        self.session: Session = session or create_session(pool_size=pool_size)
+        self.session_rate_limit = track_session_rate_limit(self.session)
         try:
             self.repo: Repository = self.github.get_repo(repository)
         except UnknownObjectException:
@@ -30,22 +201,84 @@ class GithubImport:
         return self.repo.full_name
 
     def get_remaining_rate_limit(self) -> int:
-        return self.github.rate_limiting[0]
+        return self.get_rate_limit_status()[0]
+
+    def get_rate_limit_status(self) -> Tuple[int, int, int]:
+        """
+        Remaining calls, hourly limit and reset timestamp, from the headers of the last response, of PyGithub or of the
+        session (issue imports)
+        """
+        remaining, limit = self.github.rate_limiting
+        status = (remaining, limit, self.github.rate_limiting_resettime)
+        session_status = self.session_rate_limit.status
+        if session_status is None:
+            return status
+        # The last response has the latest reset, or the fewest remaining calls of the same hour
+        return max(status, session_status, key=lambda rate_limit: (rate_limit[2], -rate_limit[0]))
+
+    def get_read_repo(self) -> Repository:
+        """The repository, bound to the token with the most remaining budget"""
+        if not self.read_clients:
+            return self.repo
+        # rate_limiting comes from the headers of the last response of each client
+        github = max([self.github, *self.read_clients], key=lambda client: client.rate_limiting[0])
+        if github is self.github:
+            return self.repo
+        return github.get_repo(self.repo.full_name, lazy=True)
+
+    def get_writable_issue(self, issue: Issue) -> Issue:
+        """Issues read with another token must be fetched again to be modified with access_token"""
+        if not self.read_clients:
+            return issue
+        return self.repo.get_issue(issue.number)
+
+    def get_writable_pull(self, pull: PullRequest) -> PullRequest:
+        if not self.read_clients:
+            return pull
+        return self.repo.get_pull(pull.number)
 
     def get_issues_count(self) -> int:
-        return self.repo.get_issues(state="all").totalCount
+        return self.get_read_repo().get_issues(state="all").totalCount
 
     def get_pulls_count(self) -> int:
-        return self.repo.get_pulls(state="all").totalCount
+        return self.get_read_repo().get_pulls(state="all").totalCount
 
     def get_issues(self) -> Dict[int, Issue]:
-        issues = self.repo.get_issues(state="all")
+        issues = self.get_read_repo().get_issues(state="all")
         return {x.number: x for x in issues}
 
     def get_pulls(self) -> Dict[int, PullRequest]:
-        pulls = self.repo.get_pulls(state="all")
+        pulls = self.get_read_repo().get_pulls(state="all")
         return {x.number: x for x in pulls}
 
+    def get_issue(self, number: int) -> Optional[Issue]:
+        try:
+            return self.get_read_repo().get_issue(number)
+        except UnknownObjectException:
+            return None
+
+    def get_pull(self, number: int) -> PullRequest:
+        return self.get_read_repo().get_pull(number)
+
+    def find_issue_by_title_prefix(self, prefix: str) -> Optional[Issue]:
+        """
+        The issue or pull request whose title starts with prefix, found with the search API.
+        Items created in the last minute may not be indexed yet.
+        """
+        query = f'repo:{self.get_repo_full_name()} in:title "{prefix}"'
+        # The search API has its own rate limit, it is not worth picking a read token
+        return next((issue for issue in self.github.search_issues(query) if issue.title.startswith(prefix)), None)
+
+    def find_issue_by_title_and_date(self, title: str, created_at: str) -> Optional[Issue]:
+        """
+        The issue with title created at created_at, in GitHub format, found with the search API. Migrated issues have
+        the title and creation date of their Bitbucket issue. Items created in the last minute may not be indexed yet.
+        """
+        created = created_at.replace("Z", "+00:00")
+        query = f"repo:{self.get_repo_full_name()} is:issue created:{created}"
+        # GitHub removes the spaces around titles
+        return next((issue for issue in self.github.search_issues(query) if issue.title == title.strip()), None)
+
     def get_gist_by_description(self, description) -> Optional[Gist]:
         return next((x for x in self.github.get_user().get_gists() if x.description == description), None)
 
@@ -57,41 +290,72 @@ class GithubImport:
             gist.edit(gist_data["description"], gist_data["files"])
         return gist
 
-    def create_issue_with_comments(self, issue_data: Dict, dry_run: bool) -> None:
+    def import_issue(self, issue_data: Dict, poll_delay: float = 1) -> Dict:
         """
-        Push a single issue to GitHub.
-        Importing via GitHub's normal Issue API quickly triggers anti-abuse rate
-        limits. So we use their dedicated Issue Import API instead:
-        https://gist.github.com/jonmagic/5282384165e0f86ef105
-        https://github.com/nicoddemus/bitbucket_issue_migration/issues/1
+        Import a single issue with GitHub's Issue Import API and wait until the import is done.
+        Returns the last import status.
         """
-        if dry_run:
-            print(f"Would create issue with data {issue_data}")
-            return
-
         url = f"https://api.github.com/repos/{self.get_repo_full_name()}/import/issues"
         headers = {
             "Authorization": f"token {self.access_token}",
             "Accept": "application/vnd.github.golden-comet-preview+json",
         }
-        res = requests.post(url, json=issue_data, headers=headers)
+        res = self.session.post(url, json=issue_data, headers=headers)
         if not res.ok:
             res.raise_for_status()
         import_data = res.json()
         import_status = import_data["status"]
-        delay = 1
+        delay = poll_delay
         while import_status == "pending":
             print("Waiting...")
             sleep(delay)
             delay = min(5, delay + 1)
-            import_data = get_request_json(import_data["url"], headers=headers)
+            import_data = get_request_json(import_data["url"], self.session, headers=headers)
             import_status = import_data["status"]
+        return import_data
 
+    def create_issue_with_comments(self, issue_data: Dict, dry_run: bool) -> Optional[int]:
+        """
+        Push a single issue to GitHub.
+        Importing via GitHub's normal Issue API quickly triggers anti-abuse rate
+        limits. So we use their dedicated Issue Import API instead:
+        https://gist.github.com/jonmagic/5282384165e0f86ef105
+        https://github.com/nicoddemus/bitbucket_issue_migration/issues/1
+        Returns the number of the created issue, None if it is not known.
+        """
+        if dry_run:
+            print(f"Would create issue with data {issue_data}")
+            return None
+
+        import_data = self.import_issue(issue_data)
+        import_status = import_data["status"]
         if import_status != "imported":
             print(f"Warning: import status is '{import_status}'.")
         if import_status == "failed":
             print(f"Retrying... (import status '{import_status}')")
-            self.slow_create_issue_with_comments(issue_data, dry_run)
+            return self.slow_create_issue_with_comments(issue_data, dry_run)
+        if "issue_url" not in import_data:
+            return None
+        return int(import_data["issue_url"].rsplit("/", 1)[-1])
+
+    def import_issue_with_number(self, number: int, issue_data: Dict, dry_run: bool) -> bool:
+        """
+        Import an issue, with its comments and dates, which must get the given number.
+        GitHub gives imported issues the next free number, imports must be done one at a time and in order.
+        Returns False when the import failed, the number is then still free.
+        """
+        if dry_run:
+            print(f"Would import issue #{number} with data {issue_data}")
+            return True
+
+        import_data = self.import_issue(issue_data, poll_delay=0.2)
+        if import_data["status"] != "imported":
+            print(f"Warning: import of issue #{number} failed: {import_data.get('errors')}")
+            return False
+        created_number = int(import_data["issue_url"].rsplit("/", 1)[-1])
+        if created_number != number:
+            raise Exception(f"Failed to import issue #{number}: GitHub created issue #{created_number}")
+        return True
 
     def update_issue_comments(self, issue: Issue, comments_data: List[Dict], dry_run: bool) -> None:
         issue_id = issue.number
@@ -123,6 +387,7 @@ class GithubImport:
             print(f"Would update issue {issue.number} with {meta}")
             return
 
+        issue = self.get_writable_issue(issue)
         issue.edit(
             title=meta["title"],
             body=meta["body"],
@@ -132,11 +397,11 @@ class GithubImport:
         )
         self.update_issue_comments(issue, issue_data["comments"], dry_run=dry_run)
 
-    def slow_create_issue_with_comments(self, issue_data: Dict, dry_run: bool) -> None:
+    def slow_create_issue_with_comments(self, issue_data: Dict, dry_run: bool) -> Optional[int]:
         meta = issue_data["issue"]
         if dry_run:
             print(f"Would create issue with {issue_data}")
-            return
+            return None
 
         issue = self.repo.create_issue(
             title=meta["title"],
@@ -146,6 +411,7 @@ class GithubImport:
         )
         issue.edit(state="closed" if meta["closed"] else "open")
         self.update_issue_comments(issue, issue_data["comments"], dry_run=dry_run)
+        return issue.number
 
     def update_pull_comments(self, pull: PullRequest, comments_data: List[Dict], dry_run: bool) -> None:
         pull_id = pull.number
@@ -176,6 +442,7 @@ class GithubImport:
         if dry_run:
             print(f"Would update pull {pull.number} with {meta}")
             return
+        pull = self.get_writable_pull(pull)
         assert meta["head"] == pull.head.ref
         pull.edit(
             title=meta["title"],
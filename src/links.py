@@ -0,0 +1,82 @@
+import re
+from typing import Dict, Match, Optional, Tuple
+
+# Characters ending a link in markdown text
+LINK_END = r"[^\s()\[\]<>\"'`]"
+
+# A single pattern for all the repositories: its cost grows with the size of the text, not with the number of
+# repositories. Code is matched first so that it is kept as it is.
+LINK_PATTERN = re.compile(
+    r"(?P<code>```.*?```|`[^`\n]*`)"
+    r"|https?://(?:www\.)?bitbucket\.org/(?P<repo>[\w.-]+/[\w.-]+?)(?:\.git)?"
+    r"(?:/issues/(?P<issue>\d+)(?:/[\w.-]*)?"
+    r"|/pull-requests/(?P<pull>\d+)(?:/[\w.-]*)*"
+    r"|/commits?/(?P<commit>[0-9a-f]{7,40})"
+    rf"|/src/(?P<src>{LINK_END}*)"
+    r")?(?![\w/.-]*\w)"
+    r"|(?<![\w&#/])(?P<pull_prefix>pull request )?#(?P<ref>\d+)\b",
+    re.DOTALL | re.IGNORECASE,
+)
+
+ISSUE = "issue"
+PULL = "pull"
+
+
+class LinkRewriter:
+    """
+    Rewrite the links to the Bitbucket repositories of KNOWN_REPO_MAPPING into links to their GitHub repositories,
+    and the references to issues and pull requests into references to their GitHub numbers.
+    Issue and pull request numbers are only known for the migrated repository, from its previous migrations.
+    Links to items without a known number are kept.
+    """
+
+    def __init__(self, bb_repo: str, repo_mapping: Dict[str, str], keep_issue_numbers: bool = False):
+        self.bb_repo = bb_repo
+        self.repo_mapping = dict(repo_mapping)
+        self.keep_issue_numbers = keep_issue_numbers
+        self.numbers: Dict[Tuple[str, str, int], int] = {}
+
+    def add_number(self, kind: str, bb_id: int, gh_number: int) -> None:
+        self.numbers[(self.bb_repo, kind, bb_id)] = gh_number
+
+    def get_number(self, bb_repo: str, kind: str, bb_id: int) -> Optional[int]:
+        if kind == ISSUE and bb_repo == self.bb_repo and self.keep_issue_numbers:
+            return bb_id
+        return self.numbers.get((bb_repo, kind, bb_id))
+
+    def rewrite(self, text: str) -> str:
+        if not text:
+            return text
+        return LINK_PATTERN.sub(self._replace, text)
+
+    def _replace(self, match: Match) -> str:
+        if match.group("code") is not None:
+            return match.group(0)
+        if match.group("ref") is not None:
+            return self._replace_reference(match)
+
+        gh_repo = self.repo_mapping.get(match.group("repo"))
+        if gh_repo is None:
+            return match.group(0)
+        gh_url = f"https://github.com/{gh_repo}"
+        if match.group("issue") is not None:
+            number = self.get_number(match.group("repo"), ISSUE, int(match.group("issue")))
+            return f"{gh_url}/issues/{number}" if number is not None else match.group(0)
+        if match.group("pull") is not None:
+            number = self.get_number(match.group("repo"), PULL, int(match.group("pull")))
+            # GitHub redirects issue links to the pull request
+            return f"{gh_url}/issues/{number}" if number is not None else match.group(0)
+        if match.group("commit") is not None:
+            return f"{gh_url}/commit/{match.group('commit')}"
+        if match.group("src") is not None:
+            # The query (e.g. ?at=branch) is Bitbucket specific
+            return f"{gh_url}/blob/{match.group('src').split('?', 1)[0]}"
+        return gh_url
+
+    def _replace_reference(self, match: Match) -> str:
+        """#12 is an issue of the same repository for Bitbucket, 'pull request #12' a pull request"""
+        kind = PULL if match.group("pull_prefix") else ISSUE
+        number = self.get_number(self.bb_repo, kind, int(match.group("ref")))
+        if number is None:
+            return match.group(0)
+        return f"{match.group('pull_prefix') or ''}#{number}"
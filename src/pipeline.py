@@ -0,0 +1,68 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue
+from typing import Callable, Iterable, List, Optional, TypeVar
+
+T = TypeVar("T")
+U = TypeVar("U")
+
+# Marks the end of the work for a writer
+_END = None
+
+
+def run_pipeline(
+    source: Iterable[T],
+    transform: Callable[[T], U],
+    write: Callable[[U], None],
+    transform_workers: int,
+    queue_size: int,
+    write_workers: int = 1,
+) -> None:
+    """
+    Read items from source, transform them concurrently and write the results.
+    The three stages run at the same time. Transformed items wait in a bounded queue, which blocks the reader when the
+    writers are late, so that memory stays bounded. With a single writer, items are written in the order of source.
+    The first error stops the pipeline and is raised once all the stages are stopped.
+    """
+    queue: "Queue[Optional[Future]]" = Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def fail(error: BaseException) -> None:
+        errors.append(error)
+        stop.set()
+
+    def read() -> None:
+        try:
+            for item in source:
+                if stop.is_set():
+                    break
+                queue.put(executor.submit(transform, item))
+        except BaseException as e:
+            fail(e)
+        finally:
+            for _ in range(write_workers):
+                queue.put(_END)
+
+    def write_all() -> None:
+        while (future := queue.get()) is not _END:
+            if stop.is_set():
+                future.cancel()
+                continue
+            try:
+                write(future.result())
+            except BaseException as e:
+                fail(e)
+
+    with ThreadPoolExecutor(max_workers=transform_workers) as executor:
+        threads = [threading.Thread(target=read, name="pipeline-reader", daemon=True)]
+        threads += [
+            threading.Thread(target=write_all, name=f"pipeline-writer-{i}", daemon=True) for i in range(write_workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
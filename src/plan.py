@@ -0,0 +1,179 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Tuple
+
+from .progress import format_duration
+
+# Items per page of the GitHub listings
+GITHUB_PAGE_SIZE = 100
+# Average calls made by an issue import: the import request and its status polls
+IMPORT_JOB_CALLS = 2
+# GitHub secondary rate limit on the requests creating or modifying content
+GITHUB_CONTENT_WRITES_PER_HOUR = 500
+# Bitbucket hourly limit on the issue and pull request endpoints for a user
+BITBUCKET_HOURLY_RATE_LIMIT = 1000
+
+CREATE_ISSUE = "create_issue"
+UPDATE_ISSUE = "update_issue"
+CREATE_PULL = "create_pull"
+UPDATE_PULL = "update_pull"
+RESERVE_ISSUE_NUMBER = "reserve_issue_number"
+CREATE_GIST = "create_gist"
+ADD_ATTACHMENTS = "add_attachments"
+CREATE_REPOSITORY = "create_repository"
+PUSH_REFS = "push_refs"
+SET_DEFAULT_BRANCH = "set_default_branch"
+
+
+def count_pages(items: int) -> int:
+    return max(1, math.ceil(items / GITHUB_PAGE_SIZE))
+
+
+@dataclass
+class PlannedCalls:
+    gh_reads: int = 0
+    gh_writes: int = 0
+    import_jobs: int = 0
+    gist_writes: int = 0
+    bb_calls: int = 0
+
+    @property
+    def gh_rest_calls(self) -> int:
+        return self.gh_reads + self.gh_writes + self.import_jobs * IMPORT_JOB_CALLS
+
+    def add(self, other: "PlannedCalls") -> None:
+        for key, value in asdict(other).items():
+            setattr(self, key, getattr(self, key) + value)
+
+
+def estimate_write_calls(action: str, payload: Dict[str, Any], existing_comments: int, refetch: bool) -> PlannedCalls:
+    """
+    GitHub calls made by GithubImport for a write. Existing comments are edited, then new ones are created and
+    extra ones deleted. An item read with a read token is fetched again with the write token (refetch).
+    """
+    comments = len(payload["comments"])
+    comment_writes = max(comments, existing_comments)
+    if action in (CREATE_ISSUE, RESERVE_ISSUE_NUMBER):
+        return PlannedCalls(import_jobs=1)
+    if action == UPDATE_ISSUE:
+        # Edit the issue
+        return PlannedCalls(gh_reads=int(refetch) + count_pages(existing_comments), gh_writes=1 + comment_writes)
+    if action == CREATE_PULL:
+        # Create the pull, set its labels and assignees, request reviews
+        writes = 3 + int(bool(payload["pull"]["reviewers"])) + comments
+        return PlannedCalls(gh_writes=writes)
+    if action == UPDATE_PULL:
+        # Get the review requests. Edit the pull, set its labels, remove and add assignees, replace review requests.
+        return PlannedCalls(gh_reads=int(refetch) + 1 + count_pages(existing_comments), gh_writes=6 + comment_writes)
+    raise ValueError(f"Unknown write action '{action}'")
+
+
+def estimate_duration(
+    calls: PlannedCalls, gh_rate_limit: Tuple[int, int, int], bb_read_seconds: float = 0.0
+) -> Dict[str, float]:
+    """
+    Lower bounds of the duration, in seconds, set by each limit. The migration lasts at least as long as the largest.
+    gh_rate_limit is the remaining calls, hourly limit and reset timestamp of the write token.
+    """
+    remaining, limit, reset_at = gh_rate_limit
+    gh_rate_limit_seconds = 0.0
+    if calls.gh_rest_calls > remaining:
+        # Wait for the current window to end, then for as many full windows as needed
+        windows = math.ceil((calls.gh_rest_calls - remaining) / max(1, limit))
+        gh_rate_limit_seconds = max(0.0, reset_at - time.time()) + (windows - 1) * 3600
+    return {
+        "github_rate_limit": gh_rate_limit_seconds,
+        "github_content_writes": 3600 * calls.gh_writes / GITHUB_CONTENT_WRITES_PER_HOUR,
+        # The plan does the same Bitbucket reads as the migration, how long they took is a good estimation
+        "bitbucket": max(bb_read_seconds, 3600 * calls.bb_calls / BITBUCKET_HOURLY_RATE_LIMIT),
+    }
+
+
+def format_estimation(calls: PlannedCalls, durations: Dict[str, float]) -> str:
+    limits = ", ".join(f"{name.replace('_', ' ')} {format_duration(seconds)}" for name, seconds in durations.items())
+    return (
+        f"  Bitbucket calls: {calls.bb_calls}\n"
+        f"  GitHub REST calls: {calls.gh_rest_calls} (reads {calls.gh_reads}, writes {calls.gh_writes}, "
+        f"import jobs {calls.import_jobs})\n"
+        f"  Gist writes: {calls.gist_writes}\n"
+        f"  Estimated duration: {format_duration(max(durations.values()))} ({limits})"
+    )
+
+
+class MigrationPlan:
+    """
+    Record what the migration of a repository would do, instead of doing it.
+    The planned payloads are appended to a JSONL file, one line per GitHub write, to be diffed between plans.
+    The calls are counted to estimate the duration of the migration from the current rate limit budgets.
+    """
+
+    def __init__(self, bb_repo: str, gh_repo: str, path: str):
+        self.bb_repo = bb_repo
+        self.gh_repo = gh_repo
+        self.path = path
+        self.calls = PlannedCalls()
+        self.actions: Counter = Counter()
+        self.started_at = time.time()
+        self.bb_read_seconds = 0.0
+        # Items can be recorded by several writers
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def add_calls(self, calls: PlannedCalls) -> None:
+        with self._lock:
+            self.calls.add(calls)
+
+    def record(self, action: str, target: str, payload: Dict[str, Any], calls: PlannedCalls) -> None:
+        line = {
+            "repository": self.bb_repo,
+            "github_repository": self.gh_repo,
+            "action": action,
+            "target": target,
+            "payload": payload,
+            "calls": asdict(calls),
+        }
+        with self._lock:
+            self.calls.add(calls)
+            self.actions[action] += 1
+            with open(self.path, "a") as f:
+                f.write(json.dumps(line, sort_keys=True) + "\n")
+
+    def finish(self, bb_request_count: int) -> None:
+        """Count the Bitbucket calls done while planning, the migration will do the same ones"""
+        self.calls.bb_calls += bb_request_count
+        self.bb_read_seconds = time.time() - self.started_at
+
+    def estimate_duration(self, gh_rate_limit: Tuple[int, int, int]) -> Dict[str, float]:
+        return estimate_duration(self.calls, gh_rate_limit, self.bb_read_seconds)
+
+    def format_summary(self, gh_rate_limit: Tuple[int, int, int]) -> str:
+        actions = ", ".join(f"{action} {count}" for action, count in sorted(self.actions.items())) or "nothing"
+        return (
+            f"Plan for Bitbucket repository '{self.bb_repo}' to GitHub repository '{self.gh_repo}':\n"
+            f"  Writes: {actions}\n"
+            f"{format_estimation(self.calls, self.estimate_duration(gh_rate_limit))}"
+        )
+
+
+def format_plans_total(plans: List[MigrationPlan], gh_rate_limit: Tuple[int, int, int]) -> str:
+    """Estimation for migrating the repositories one after the other with the same tokens"""
+    calls = PlannedCalls()
+    for plan in plans:
+        calls.add(plan.calls)
+    bb_read_seconds = sum(plan.bb_read_seconds for plan in plans)
+    return (
+        f"Plan for {len(plans)} repositories:\n"
+        f"{format_estimation(calls, estimate_duration(calls, gh_rate_limit, bb_read_seconds))}"
+    )
+
+
+def planned_attachment_url(backend: str, issue_id: int, name: str) -> str:
+    """Attachments are not uploaded by a plan, their URLs are not known"""
+    return f"<{backend} attachment issue-{issue_id}/{name}>"
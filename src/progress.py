@@ -0,0 +1,206 @@
+import json
+import math
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# GitHub REST API hourly quota for an authenticated user
+GITHUB_HOURLY_RATE_LIMIT = 5000
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+@dataclass
+class PhaseProgress:
+    name: str
+    total: int
+    done: int = 0
+    bb_calls: int = 0
+    gh_calls: int = 0
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.total - self.done)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def items_per_second(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return self.done / self.elapsed
+
+    @property
+    def calls_per_item(self) -> float:
+        if self.done == 0:
+            return 0.0
+        return (self.bb_calls + self.gh_calls) / self.done
+
+    @property
+    def gh_calls_per_item(self) -> float:
+        if self.done == 0:
+            return 0.0
+        return self.gh_calls / self.done
+
+
+class ProgressTracker:
+    """
+    Track the throughput of each migration phase and estimate when it will finish.
+    The estimation takes the GitHub rate limit into account: if the remaining items need more calls than the
+    remaining budget, the time until the budget is reset is added to the estimation.
+    """
+
+    def __init__(
+        self,
+        repository: str,
+        bb_calls_counter: Callable[[], int],
+        gh_rate_limit: Callable[[], Tuple[int, int, int]],
+        status_file: Optional[str] = None,
+        refresh_interval: float = 10.0,
+    ):
+        self.repository = repository
+        self.bb_calls_counter = bb_calls_counter
+        self.gh_rate_limit = gh_rate_limit
+        self.status_file = status_file
+        self.refresh_interval = refresh_interval
+        self.phases: List[PhaseProgress] = []
+        self.last_report = 0.0
+        self._bb_calls_mark = 0
+        self._gh_remaining_mark: Optional[int] = None
+        self._gh_remaining = GITHUB_HOURLY_RATE_LIMIT
+        self._gh_limit = GITHUB_HOURLY_RATE_LIMIT
+        self._gh_reset_at = 0
+        # Items can be completed by several writers
+        self._lock = threading.Lock()
+
+    @property
+    def current_phase(self) -> Optional[PhaseProgress]:
+        return self.phases[-1] if self.phases else None
+
+    def start_phase(self, name: str, total: int) -> None:
+        self.finish_phase()
+        self._bb_calls_mark = self.bb_calls_counter()
+        self._refresh_rate_limit()
+        self._gh_remaining_mark = self._gh_remaining
+        self.phases.append(PhaseProgress(name, total))
+        self.report(force=True)
+
+    def finish_phase(self) -> None:
+        phase = self.current_phase
+        if phase is None or phase.finished_at is not None:
+            return
+        self._count_calls(phase)
+        phase.finished_at = time.time()
+        self.report(force=True)
+
+    def advance(self, count: int = 1) -> None:
+        with self._lock:
+            phase = self.current_phase
+            if phase is None:
+                return
+            phase.done += count
+            self._count_calls(phase)
+            self.report()
+
+    def _refresh_rate_limit(self) -> None:
+        self._gh_remaining, self._gh_limit, self._gh_reset_at = self.gh_rate_limit()
+
+    def _count_calls(self, phase: PhaseProgress) -> None:
+        bb_calls = self.bb_calls_counter()
+        phase.bb_calls += bb_calls - self._bb_calls_mark
+        self._bb_calls_mark = bb_calls
+
+        self._refresh_rate_limit()
+        if self._gh_remaining_mark is not None and self._gh_remaining <= self._gh_remaining_mark:
+            phase.gh_calls += self._gh_remaining_mark - self._gh_remaining
+        # A higher remaining count means that the rate limit was reset, the calls in between are lost
+        self._gh_remaining_mark = self._gh_remaining
+
+    def estimate_remaining_seconds(self, phase: PhaseProgress) -> Optional[float]:
+        if phase.remaining == 0:
+            return 0.0
+        if phase.items_per_second <= 0:
+            return None
+        eta = phase.remaining / phase.items_per_second
+
+        needed_gh_calls = phase.remaining * phase.gh_calls_per_item
+        if needed_gh_calls > self._gh_remaining:
+            # Wait for the current window to end, then for as many full windows as needed
+            missing_calls = needed_gh_calls - self._gh_remaining
+            windows = math.ceil(missing_calls / max(1, self._gh_limit))
+            until_reset = max(0.0, self._gh_reset_at - time.time())
+            eta = max(eta, until_reset + (windows - 1) * 3600)
+        return eta
+
+    def status(self) -> Dict[str, Any]:
+        phases = []
+        for phase in self.phases:
+            phase_status = asdict(phase)
+            phase_status.update(
+                {
+                    "remaining": phase.remaining,
+                    "elapsed_seconds": round(phase.elapsed, 1),
+                    "items_per_second": round(phase.items_per_second, 3),
+                    "calls_per_item": round(phase.calls_per_item, 2),
+                    "eta_seconds": self.estimate_remaining_seconds(phase),
+                }
+            )
+            phases.append(phase_status)
+        return {
+            "repository": self.repository,
+            "updated_at": time.time(),
+            "github_rate_limit": {
+                "remaining": self._gh_remaining,
+                "limit": self._gh_limit,
+                "reset_at": self._gh_reset_at,
+            },
+            "phases": phases,
+        }
+
+    def format_line(self) -> str:
+        phase = self.current_phase
+        if phase is None:
+            return f"[progress] {self.repository} idle"
+        percent = 100 * phase.done / phase.total if phase.total else 100
+        return (
+            f"[progress] {self.repository} {phase.name} {phase.done}/{phase.total} ({percent:.0f}%) "
+            f"{phase.items_per_second:.2f} items/s {phase.calls_per_item:.1f} calls/item "
+            f"GitHub budget {self._gh_remaining}/{self._gh_limit} "
+            f"ETA {format_duration(self.estimate_remaining_seconds(phase))}"
+        )
+
+    def report(self, force: bool = False) -> None:
+        now = time.time()
+        if not force and now - self.last_report < self.refresh_interval:
+            return
+        self.last_report = now
+        print(self.format_line())
+        if self.status_file:
+            self.write_status_file()
+
+    def write_status_file(self) -> None:
+        directory = os.path.dirname(self.status_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write then rename so that readers never see a partial file
+        tmp_file = f"{self.status_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.status(), f, indent=2)
+        os.replace(tmp_file, self.status_file)
@@ -0,0 +1,155 @@
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+# Bitbucket issues and pull requests are kept for the whole migration of a repository. They are stored in slotted
+# records holding only the fields read by the construct_gh_* functions, instead of the dicts of the responses.
+# The values repeated by many items (nicknames, states, branches...) are interned, so that they are stored once.
+
+
+def intern_optional(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value is not None else None
+
+
+def get_nickname(bb_user: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Nickname of a user of a response, None without user, empty for a deleted account"""
+    if bb_user is None:
+        return None
+    return sys.intern(bb_user.get("nickname") or "")
+
+
+def get_optional(raw: Dict[str, Any], path: str) -> Any:
+    """Value of a dotted path of a response, None if a part of the path is missing or null"""
+    value: Any = raw
+    for key in path.split("."):
+        if value is None:
+            return None
+        value = value.get(key)
+    return value
+
+
+@dataclass
+class BitbucketIssue:
+    __slots__ = (
+        "id",
+        "title",
+        "content",
+        "created_on",
+        "updated_on",
+        "state",
+        "kind",
+        "priority",
+        "component",
+        "reporter",
+        "assignee",
+    )
+    id: int
+    title: str
+    content: str
+    created_on: str
+    updated_on: str
+    state: str
+    kind: str
+    priority: str
+    component: Optional[str]
+    reporter: Optional[str]
+    assignee: Optional[str]
+
+    @classmethod
+    def from_json(cls, raw: Dict[str, Any]) -> "BitbucketIssue":
+        return cls(
+            id=raw["id"],
+            title=raw["title"],
+            # Partial responses omit the null fields
+            content=get_optional(raw, "content.raw") or "",
+            created_on=raw["created_on"],
+            updated_on=raw["updated_on"],
+            state=sys.intern(raw["state"]),
+            kind=sys.intern(raw["kind"]),
+            priority=sys.intern(raw["priority"]),
+            component=intern_optional(get_optional(raw, "component.name")),
+            reporter=get_nickname(raw.get("reporter")),
+            assignee=get_nickname(raw.get("assignee")),
+        )
+
+
+@dataclass
+class BitbucketEndpoint:
+    """Source or destination of a pull request"""
+
+    __slots__ = ("branch", "commit", "repository")
+    branch: Optional[str]
+    commit: Optional[str]
+    repository: Optional[str]
+
+    @classmethod
+    def from_json(cls, raw: Dict[str, Any]) -> "BitbucketEndpoint":
+        return cls(
+            branch=intern_optional(get_optional(raw, "branch.name")),
+            commit=get_optional(raw, "commit.hash"),
+            repository=intern_optional(get_optional(raw, "repository.full_name")),
+        )
+
+
+@dataclass
+class BitbucketParticipant:
+    __slots__ = ("user", "role", "approved")
+    user: Optional[str]
+    role: str
+    approved: bool
+
+    @classmethod
+    def from_json(cls, raw: Dict[str, Any]) -> "BitbucketParticipant":
+        return cls(user=get_nickname(raw.get("user")), role=sys.intern(raw["role"]), approved=raw["approved"])
+
+
+@dataclass
+class BitbucketPull:
+    __slots__ = (
+        "id",
+        "title",
+        "description",
+        "created_on",
+        "updated_on",
+        "state",
+        "author",
+        "source",
+        "destination",
+        "merge_commit",
+        "participants",
+        "reviewers",
+    )
+    id: int
+    title: str
+    description: str
+    created_on: str
+    updated_on: str
+    state: str
+    author: Optional[str]
+    source: BitbucketEndpoint
+    destination: BitbucketEndpoint
+    merge_commit: Optional[str]
+    # None when the listing of the pull requests does not include them
+    participants: Optional[List[BitbucketParticipant]]
+    reviewers: Optional[List[Optional[str]]]
+
+    @classmethod
+    def from_json(cls, raw: Dict[str, Any]) -> "BitbucketPull":
+        participants = raw.get("participants")
+        reviewers = raw.get("reviewers")
+        return cls(
+            id=raw["id"],
+            title=raw["title"],
+            description=raw.get("description") or "",
+            created_on=raw["created_on"],
+            updated_on=raw["updated_on"],
+            state=sys.intern(raw["state"]),
+            author=get_nickname(raw.get("author")),
+            source=BitbucketEndpoint.from_json(raw["source"]),
+            destination=BitbucketEndpoint.from_json(raw["destination"]),
+            merge_commit=get_optional(raw, "merge_commit.hash"),
+            participants=(
+                [BitbucketParticipant.from_json(p) for p in participants] if participants is not None else None
+            ),
+            reviewers=[get_nickname(reviewer) for reviewer in reviewers] if reviewers is not None else None,
+        )
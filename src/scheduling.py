@@ -0,0 +1,55 @@
+import threading
+import time
+from enum import Enum
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Priority(str, Enum):
+    # Open issues and pull requests first
+    open = "open"
+    # Recently updated items first
+    recent = "recent"
+    # Pull requests whose branches exist in GitHub first, they become GitHub pull requests
+    branches = "branches"
+
+
+class MigrationLimits:
+    """
+    Stop migrating new items after time_limit seconds, or once github_budget GitHub calls are spent, so that the items
+    migrated first are available in time. The items left are migrated by a later run.
+    The spent calls are counted from the remaining rate limit of the last responses, without extra calls.
+    """
+
+    def __init__(self, time_limit: Optional[float], github_budget: Optional[int], gh_remaining: Callable[[], int]):
+        self.deadline = time.monotonic() + time_limit if time_limit is not None else None
+        self.github_budget = github_budget
+        self.gh_remaining = gh_remaining
+        self.spent_calls = 0
+        self._last_remaining = gh_remaining() if github_budget is not None else 0
+        # Name of the reached limit
+        self.reached_limit: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def is_reached(self) -> bool:
+        with self._lock:
+            if self.reached_limit is not None:
+                return True
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self.reached_limit = "time limit"
+            elif self.github_budget is not None:
+                remaining = self.gh_remaining()
+                # The remaining calls go up when the hourly limit is reset
+                self.spent_calls += max(0, self._last_remaining - remaining)
+                self._last_remaining = remaining
+                if self.spent_calls >= self.github_budget:
+                    self.reached_limit = "GitHub budget"
+            return self.reached_limit is not None
+
+    def limit(self, items: Iterable[T]) -> Iterator[T]:
+        """The items until a limit is reached"""
+        for item in items:
+            if self.is_reached():
+                return
+            yield item
@@ -0,0 +1,153 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+
+@dataclass
+class Shard:
+    repository: str
+    kind: str
+    start_id: int
+    end_id: int
+    attempts: int = 0
+
+    def __str__(self) -> str:
+        return f"{self.kind} {self.start_id}-{self.end_id} of {self.repository}"
+
+    def contains(self, item_id: int) -> bool:
+        return self.start_id <= item_id <= self.end_id
+
+
+class ShardStore:
+    """
+    Lease table shared by the workers migrating the same repositories, stored in a SQLite file on a shared volume.
+    A worker claims a pending shard, or a shard whose lease expired because its worker died, and keeps renewing the
+    lease while it works on it. Timestamps come from the workers, their clocks must be synchronized.
+    """
+
+    def __init__(self, path: str, lease_seconds: int = 600):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        with self._transaction() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS shards (
+                    repository TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    start_id INTEGER NOT NULL,
+                    end_id INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    owner TEXT,
+                    lease_expires_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    completed_at REAL,
+                    PRIMARY KEY (repository, kind, start_id)
+                )
+                """)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # A connection per transaction, so that the store can be used from the lease renewal thread
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            # Take the write lock immediately, two workers must not claim the same shard
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        finally:
+            connection.close()
+
+    def create_shards(self, repository: str, kind: str, max_id: int, shard_size: int) -> None:
+        """
+        Split ids 1 to max_id in shards. Existing shards are kept, so that all workers can call this: the ids after the
+        existing shards, listed by a later worker, get new shards.
+        """
+        with self._transaction() as connection:
+            covered_id = connection.execute(
+                "SELECT COALESCE(MAX(end_id), 0) FROM shards WHERE repository = ? AND kind = ?", (repository, kind)
+            ).fetchone()[0]
+            connection.executemany(
+                "INSERT INTO shards (repository, kind, start_id, end_id) VALUES (?, ?, ?, ?)",
+                [
+                    (repository, kind, start_id, min(max_id, start_id + shard_size - 1))
+                    for start_id in range(covered_id + 1, max_id + 1, shard_size)
+                ],
+            )
+
+    def claim(self, repository: str, worker_id: str) -> Optional[Shard]:
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute(
+                """
+                SELECT kind, start_id, end_id, attempts FROM shards
+                WHERE repository = ? AND (status = 'pending' OR (status = 'claimed' AND lease_expires_at < ?))
+                ORDER BY kind, start_id LIMIT 1
+                """,
+                (repository, now),
+            ).fetchone()
+            if row is None:
+                return None
+            kind, start_id, end_id, attempts = row
+            connection.execute(
+                """
+                UPDATE shards SET status = 'claimed', owner = ?, lease_expires_at = ?, attempts = attempts + 1
+                WHERE repository = ? AND kind = ? AND start_id = ?
+                """,
+                (worker_id, now + self.lease_seconds, repository, kind, start_id),
+            )
+        return Shard(repository, kind, start_id, end_id, attempts + 1)
+
+    def _update_owned(self, shard: Shard, worker_id: str, assignments: str, *values) -> bool:
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                f"""
+                UPDATE shards SET {assignments}
+                WHERE repository = ? AND kind = ? AND start_id = ? AND owner = ? AND status = 'claimed'
+                """,
+                (*values, shard.repository, shard.kind, shard.start_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, shard: Shard, worker_id: str) -> bool:
+        """Extend the lease, returns False if the shard was claimed by another worker in the meantime"""
+        return self._update_owned(shard, worker_id, "lease_expires_at = ?", time.time() + self.lease_seconds)
+
+    def complete(self, shard: Shard, worker_id: str) -> bool:
+        return self._update_owned(shard, worker_id, "status = 'completed', completed_at = ?", time.time())
+
+    def release(self, shard: Shard, worker_id: str) -> bool:
+        return self._update_owned(shard, worker_id, "status = 'pending', owner = NULL, lease_expires_at = NULL")
+
+    def count_unfinished(self, repository: str) -> int:
+        with self._transaction() as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM shards WHERE repository = ? AND status != 'completed'", (repository,)
+            ).fetchone()[0]
+
+    @contextmanager
+    def lease(self, shard: Shard, worker_id: str) -> Iterator[None]:
+        """Keep renewing the lease of the shard while the block runs. On failure, the shard is released."""
+        stop = threading.Event()
+
+        def renew_periodically() -> None:
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.renew(shard, worker_id):
+                    print(f"Warning: lost the lease of shard {shard}")
+                    return
+
+        renewal_thread = threading.Thread(target=renew_periodically, name="shard-lease", daemon=True)
+        renewal_thread.start()
+        try:
+            yield
+        except BaseException:
+            self.release(shard, worker_id)
+            raise
+        finally:
+            stop.set()
+            renewal_thread.join()
@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from .migrate_discussions import TARGETED_LOOKUP_MAX_ITEMS
+
+if TYPE_CHECKING:
+    from .bitbucket import BitbucketExport
+
+
+@dataclass
+class SyncedRepository:
+    bb_repo: str
+    gh_repo: str
+    # Update date and id of the last synced Bitbucket issue and pull request, the next cycle starts after them
+    issues_since: str
+    pulls_since: str
+    cycles: int = 0
+    last_cycle_at: Optional[float] = None
+    error: Optional[str] = None
+    issues_since_id: int = 0
+    pulls_since_id: int = 0
+    # GitHub number of each migrated Bitbucket issue, by Bitbucket id, so that issues whose title changed are found
+    issue_numbers: Dict[str, int] = field(default_factory=dict)
+
+
+class SyncState:
+    """
+    Sync progress of each repository, persisted in a JSON file after each cycle, so that a stopped sync resumes where it
+    stopped. A read only state is loaded but never saved.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self.repositories: Dict[str, SyncedRepository] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for entry in json.load(f)["repositories"]:
+                    repository = SyncedRepository(**entry)
+                    self.repositories[repository.bb_repo] = repository
+
+    def get_repository(self, bb_repo: str, gh_repo: str, since: str) -> SyncedRepository:
+        """Repositories not synced before start from since, usually the start of their migration"""
+        with self._lock:
+            if bb_repo not in self.repositories:
+                self.repositories[bb_repo] = SyncedRepository(bb_repo, gh_repo, issues_since=since, pulls_since=since)
+            return self.repositories[bb_repo]
+
+    def save(self) -> None:
+        if self.read_only:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write then rename so that an interruption never leaves a partial file
+        tmp_file = f"{self.path}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"repositories": [asdict(repository) for repository in self.repositories.values()]}, f, indent=2)
+        os.replace(tmp_file, self.path)
+
+    def update(self, repository: SyncedRepository, **changes) -> None:
+        with self._lock:
+            for key, value in changes.items():
+                setattr(repository, key, value)
+            self.save()
+
+
+def push_changed_refs(git_folder: str) -> int:
+    """
+    Fetch the Bitbucket remote of the local clone, and push to the GitHub remote only the branches and tags which
+    changed. Returns the number of pushed refs.
+    """
+    from git import FetchInfo, Repo
+    from git.refs import RemoteReference, TagReference
+
+    # Changes which are not pushed to GitHub
+    unpushed_flags = FetchInfo.HEAD_UPTODATE | FetchInfo.REJECTED | FetchInfo.ERROR
+    repo = Repo(git_folder)
+    try:
+        bb_remote = next(remote for remote in repo.remotes if any("bitbucket.org" in url for url in remote.urls))
+        refspecs = []
+        for fetch_info in bb_remote.fetch():
+            if fetch_info.flags & unpushed_flags:
+                continue
+            ref = fetch_info.ref
+            if isinstance(ref, TagReference):
+                refspecs.append(f"{ref.path}:{ref.path}")
+            elif isinstance(ref, RemoteReference) and ref.remote_head != "HEAD":
+                refspecs.append(f"{ref.path}:refs/heads/{ref.remote_head}")
+        if refspecs:
+            repo.remote("github").push(refspecs)
+        return len(refspecs)
+    finally:
+        repo.close()
+
+
+def sync_repository(
+    repository: SyncedRepository,
+    bb_export: "BitbucketExport",
+    state: SyncState,
+    budget: int,
+    git_folder: Optional[str],
+    migrate: Optional[Callable[[Optional[List[str]], Optional[List[str]], Dict[int, int]], Any]],
+) -> None:
+    """
+    Push the changed refs, then migrate the issues and pull requests updated since the previous cycle, the least
+    recently updated first and up to budget items. Items beyond the budget are migrated by the next cycles.
+    They are migrated by batches small enough for their GitHub items to be looked up one by one, instead of listing
+    all the items of both repositories, and the GitHub numbers of the issues are kept in the state.
+    Without migrate, only the refs are synced.
+    """
+    if git_folder is not None:
+        pushed = push_changed_refs(git_folder)
+        print(f"{repository.bb_repo}: pushed {pushed} changed branches and tags")
+
+    issues_cursor = (repository.issues_since, repository.issues_since_id)
+    pulls_cursor = (repository.pulls_since, repository.pulls_since_id)
+    issue_numbers = {int(bb_issue_id): number for bb_issue_id, number in repository.issue_numbers.items()}
+    if migrate is not None:
+        issues = bb_export.get_issues_updated_since(*issues_cursor, budget)
+        pulls = bb_export.get_pulls_updated_since(*pulls_cursor, budget)
+        updated = [(item["updated_on"], item["id"], "issue") for item in issues]
+        updated += [(item["updated_on"], item["id"], "pull") for item in pulls]
+        updated = sorted(updated)[:budget]
+        issues_count = sum(1 for _, _, kind in updated if kind == "issue")
+        print(f"{repository.bb_repo}: {issues_count} issues and {len(updated) - issues_count} pull requests updated")
+        for start in range(0, len(updated), TARGETED_LOOKUP_MAX_ITEMS):
+            batch = updated[start : start + TARGETED_LOOKUP_MAX_ITEMS]
+            issue_ids = [str(item_id) for _, item_id, kind in batch if kind == "issue"]
+            pull_ids = [str(item_id) for _, item_id, kind in batch if kind == "pull"]
+            # Listed items only: the other kind is not migrated
+            migrate(issue_ids or None, pull_ids or None, issue_numbers)
+        issues_cursor = max(
+            ((since, item_id) for since, item_id, kind in updated if kind == "issue"), default=issues_cursor
+        )
+        pulls_cursor = max(
+            ((since, item_id) for since, item_id, kind in updated if kind == "pull"), default=pulls_cursor
+        )
+
+    state.update(
+        repository,
+        issues_since=issues_cursor[0],
+        issues_since_id=issues_cursor[1],
+        pulls_since=pulls_cursor[0],
+        pulls_since_id=pulls_cursor[1],
+        issue_numbers={str(bb_issue_id): number for bb_issue_id, number in issue_numbers.items()},
+        cycles=repository.cycles + 1,
+        last_cycle_at=time.time(),
+        error=None,
+    )
+
+
+def run_sync_cycles(
+    repositories: List[SyncedRepository],
+    sync: Callable[[SyncedRepository], None],
+    state: SyncState,
+    interval: float,
+    parallelism: int,
+) -> None:
+    """
+    Sync the repositories every interval seconds, parallelism at a time, until interrupted.
+    A failed repository does not stop the others, it is synced again by the next cycle.
+    """
+
+    def run(repository: SyncedRepository) -> None:
+        try:
+            sync(repository)
+        except Exception as e:
+            traceback.print_exc()
+            print(f"Error: sync of {repository.bb_repo} failed, it will be retried on the next cycle")
+            state.update(repository, error=repr(e), last_cycle_at=time.time())
+
+    cycle = 0
+    while True:
+        cycle += 1
+        started_at = time.monotonic()
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="sync") as executor:
+            list(executor.map(run, repositories))
+
+        elapsed = time.monotonic() - started_at
+        failed = [repository.bb_repo for repository in repositories if repository.error is not None]
+        print(f"Sync cycle {cycle} of {len(repositories)} repositories done in {elapsed:.0f}s, {len(failed)} failed")
+        time.sleep(max(0.0, interval - elapsed))
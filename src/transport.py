@@ -0,0 +1,70 @@
+from typing import TYPE_CHECKING, Optional, Tuple
+
+# requests is imported by the functions, so that the command line starts without it
+if TYPE_CHECKING:
+    from requests import Session
+    from requests.packages.urllib3.util.retry import Retry
+
+    from .concurrency import AimdLimiter
+
+# Number of connections kept alive per host, should match the number of concurrent workers
+DEFAULT_POOL_SIZE = 8
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def create_retry(
+    total: int = 10,
+    connect: int = 10,
+    read: int = 10,
+    backoff_factor: float = 0.3,
+    statuses: Tuple[int, ...] = RETRY_STATUSES,
+) -> "Retry":
+    """Retry policy shared by the Bitbucket and GitHub clients, honoring the Retry-After header"""
+    from requests.packages.urllib3.util.retry import Retry
+
+    return Retry(
+        total=total,
+        connect=connect,
+        read=read,
+        backoff_factor=backoff_factor,
+        status_forcelist=statuses,
+        # Otherwise urllib3 retries 429 and 503 responses even when they are not in status_forcelist
+        respect_retry_after_header=bool(statuses),
+    )
+
+
+def create_session(
+    pool_size: int = DEFAULT_POOL_SIZE,
+    retry: Optional["Retry"] = None,
+    auth: Optional[Tuple[str, str]] = None,
+    limiter: Optional["AimdLimiter"] = None,
+) -> "Session":
+    """
+    Create a session keeping its connections alive, so that a TLS handshake is not paid for each request.
+    Responses are compressed and failed requests are retried with a delay.
+    With a limiter, the number of requests in flight adapts to the throttling of the server.
+    """
+    from requests import Session
+    from requests.adapters import HTTPAdapter
+
+    from .concurrency import AdaptiveHTTPAdapter
+
+    session = Session()
+    if auth is not None:
+        session.auth = auth
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    if limiter is not None:
+        adapter: HTTPAdapter = AdaptiveHTTPAdapter(
+            limiter,
+            RETRY_STATUSES,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            # Statuses are retried by the adapter, urllib3 only retries connection errors
+            max_retries=retry or create_retry(statuses=()),
+        )
+    else:
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry or create_retry())
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -0,0 +1,49 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class UserDirectoryCache:
+    """
+    Users downloaded from Bitbucket, GitHub and Jira, kept in a JSON file so that the user mapping can be tuned and run
+    again without downloading them again. Entries older than ttl_seconds are downloaded again.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        # Entries can be set by concurrent lookups
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry["fetched_at"] > self.ttl_seconds:
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.entries[key] = {"fetched_at": time.time(), "value": value}
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            self.set(key, value)
+        return value
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write then rename so that an interruption never leaves a partial file
+        tmp_file = f"{self.path}.tmp"
+        with self._lock, open(tmp_file, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_file, self.path)
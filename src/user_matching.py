@@ -0,0 +1,115 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from itertools import groupby
+from typing import Dict, List, Sequence, Set, Tuple
+
+NGRAM_SIZE = 3
+# Score of a fuzzy match between names which are not equal but have the same n-grams
+MAX_FUZZY_SCORE = 0.99
+
+# A name is identified by the index of its user and its index in the names of the user
+NameKey = Tuple[int, int]
+
+
+def get_ngrams(name: str, size: int = NGRAM_SIZE) -> Set[str]:
+    # The markers give more weight to the start and the end of the name
+    padded = f"^{name}$"
+    if len(padded) <= size:
+        return {padded}
+    return {padded[i : i + size] for i in range(len(padded) - size + 1)}
+
+
+@dataclass
+class Match:
+    left: int
+    right: int
+    score: float
+    left_name: int
+    right_name: int
+
+
+class NameIndex:
+    """
+    Index of the cleaned up names of users: a hash index for exact matches,
+    and an n-gram index for fuzzy matches scored with the Dice coefficient of their n-grams.
+    """
+
+    def __init__(self, users_names: Sequence[Sequence[str]]):
+        self.exact: Dict[str, List[NameKey]] = defaultdict(list)
+        self.ngrams: Dict[str, List[NameKey]] = defaultdict(list)
+        self.ngram_counts: Dict[NameKey, int] = {}
+        for user, names in enumerate(users_names):
+            for name_index, name in enumerate(names):
+                if not name:
+                    continue
+                key = (user, name_index)
+                self.exact[name].append(key)
+                name_ngrams = get_ngrams(name)
+                self.ngram_counts[key] = len(name_ngrams)
+                for ngram in name_ngrams:
+                    self.ngrams[ngram].append(key)
+
+    def search(self, name: str, min_score: float) -> Dict[NameKey, float]:
+        """Names matching name with a score of at least min_score, 1 for an exact match"""
+        results: Dict[NameKey, float] = {key: 1.0 for key in self.exact.get(name, [])}
+        if min_score >= 1:
+            return results
+
+        name_ngrams = get_ngrams(name)
+        shared: Dict[NameKey, int] = defaultdict(int)
+        for ngram in name_ngrams:
+            for key in self.ngrams.get(ngram, []):
+                shared[key] += 1
+        for key, shared_count in shared.items():
+            if key in results:
+                continue
+            score = min(MAX_FUZZY_SCORE, 2 * shared_count / (len(name_ngrams) + self.ngram_counts[key]))
+            if score >= min_score:
+                results[key] = score
+        return results
+
+
+def match_users(
+    left_names: Sequence[Sequence[str]], right_names: Sequence[Sequence[str]], min_score: float = 1.0
+) -> Tuple[List[Match], Dict[int, List[int]]]:
+    """
+    Match each left user to at most one right user, from the cleaned up names of the users.
+    Each pair of users is scored with the best score of their names. Pairs are then accepted from the best score down,
+    globally, so that the result does not depend on the order of the users. When, at the same score, a user could be
+    matched with several free users, none of these pairs is accepted: they are returned as ambiguous, left user to
+    right users, to be mapped by hand.
+    """
+    index = NameIndex(right_names)
+    best_pairs: Dict[Tuple[int, int], Match] = {}
+    for left, names in enumerate(left_names):
+        for left_name, name in enumerate(names):
+            if not name:
+                continue
+            for (right, right_name), score in index.search(name, min_score).items():
+                pair = best_pairs.get((left, right))
+                if pair is None or score > pair.score:
+                    best_pairs[(left, right)] = Match(left, right, score, left_name, right_name)
+
+    matches: List[Match] = []
+    ambiguous: Dict[int, List[int]] = {}
+    taken_left: Set[int] = set()
+    taken_right: Set[int] = set()
+    pairs = sorted(best_pairs.values(), key=lambda pair: (-pair.score, pair.left, pair.right))
+    for _, same_score_pairs in groupby(pairs, key=lambda pair: pair.score):
+        free_pairs = [
+            pair for pair in same_score_pairs if pair.left not in taken_left and pair.right not in taken_right
+        ]
+        left_counts: Dict[int, int] = defaultdict(int)
+        right_counts: Dict[int, int] = defaultdict(int)
+        for pair in free_pairs:
+            left_counts[pair.left] += 1
+            right_counts[pair.right] += 1
+        for pair in free_pairs:
+            if left_counts[pair.left] == 1 and right_counts[pair.right] == 1:
+                matches.append(pair)
+            else:
+                ambiguous.setdefault(pair.left, []).append(pair.right)
+        # Users of ambiguous pairs are not matched with lower scores either
+        taken_left.update(pair.left for pair in free_pairs)
+        taken_right.update(pair.right for pair in free_pairs)
+    return matches, ambiguous
@@ -1,5 +1,33 @@
+import json
+from typing import Any, Callable, Dict, Iterator, Optional
+
 import requests
 
+# Optional faster JSON backends, the standard library is used when they are not installed
+try:
+    import orjson
+
+    json_loads: Callable[[bytes], Any] = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    try:
+        import ujson
+
+        json_loads = ujson.loads
+        JSON_BACKEND = "ujson"
+    except ImportError:
+        json_loads = json.loads
+        JSON_BACKEND = "json"
+
+# Optional incremental parser, so that a page is decoded while it is downloaded instead of being held in memory
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ijson = None
+
+COMPRESSION_HEADERS = {"Accept-Encoding": "gzip, deflate"}
+
 
 def get_request_content(url, session=None):
     if session is None:
@@ -10,10 +38,60 @@ def get_request_content(url, session=None):
     return res.text
 
 
+def get_request_bytes(url, session=None):
+    if session is None:
+        session = requests
+    res = session.get(url)
+    if not res.ok:
+        res.raise_for_status()
+    return res.content
+
+
 def get_request_json(url, session=None, headers=None):
     if session is None:
         session = requests
-    res = session.get(url, headers=headers)
+    res = session.get(url, headers={**COMPRESSION_HEADERS, **(headers or {})})
     if not res.ok:
         res.raise_for_status()
-    return res.json()
+    return json_loads(res.content)
+
+
+def stream_paginated_values(
+    url: str, session: Optional[requests.Session] = None, values_key: str = "values", next_key: str = "next"
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the values of all the pages, following the next links.
+    With ijson installed, the values are yielded as soon as they are parsed from the streamed response.
+    """
+    if session is None:
+        session = requests
+    next_url: Optional[str] = url
+
+    while next_url is not None:
+        if ijson is None:
+            page = get_request_json(next_url, session)
+            next_url = page.get(next_key, None)
+            yield from page[values_key]
+            continue
+
+        with session.get(next_url, headers=COMPRESSION_HEADERS, stream=True) as res:
+            if not res.ok:
+                res.raise_for_status()
+            res.raw.decode_content = True
+            next_url = None
+            item_prefix = f"{values_key}.item"
+            builder: Optional[ObjectBuilder] = None
+            for prefix, event, value in ijson.parse(res.raw, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == item_prefix and event in ("end_map", "end_array"):
+                        yield builder.value
+                        builder = None
+                elif prefix == item_prefix:
+                    if event in ("start_map", "start_array"):
+                        builder = ObjectBuilder()
+                        builder.event(event, value)
+                    else:
+                        yield value
+                elif prefix == next_key and event == "string":
+                    next_url = value
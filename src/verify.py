@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import typer
+
+import config
+from src.bitbucket import BitbucketExport
+from src.comments import CommentCompaction
+from src.github import GithubImport, get_repository_items
+from src.links import ISSUE, PULL, LinkRewriter
+from src.migrate_discussions import (
+    MigrationConfig,
+    bb_pull_is_closed,
+    bb_pull_maps_gh_pull,
+    build_gh_title_from_bb_pull,
+    construct_gh_issue_from_bb_issue,
+    construct_gh_issue_from_bb_pull,
+    construct_gh_issue_labels,
+    construct_gh_pull_from_bb_pull,
+    construct_gh_pull_labels,
+    convert_date,
+    list_gh_branches,
+    map_bb_state_to_gh_state,
+    open_git_objects,
+)
+from src.progress import ProgressTracker
+from src.records import BitbucketIssue, BitbucketPull
+from src.transport import DEFAULT_POOL_SIZE
+
+BB_ISSUE_TITLE_RE = re.compile(r"\[BB i#(?P<bb_id>\d+)]")
+BB_PULL_TITLE_RE = re.compile(r"\[BB pr#(?P<bb_id>\d+)]")
+# Attachment lines of the issue bodies, see construct_gh_issue_body
+ATTACHMENT_RE = re.compile(r"^\* \[\*\*`(?P<name>.+?)`\*\*]\((?P<url>\S+)\)$", re.MULTILINE)
+
+
+def hash_text(text: Optional[str]) -> str:
+    # GitHub may return the line breaks of a body as CRLF
+    normalized = (text or "").replace("\r\n", "\n").rstrip()
+    return hashlib.sha256(normalized.encode()).hexdigest()[:16]
+
+
+@dataclass
+class VerifiedItem:
+    """What is compared between Bitbucket and GitHub, the bodies and comments are only kept as hashes"""
+
+    title: str
+    closed: bool
+    labels: List[str]
+    is_pull: bool
+    body_hash: Optional[str] = None
+    comment_hashes: Optional[List[str]] = None
+
+
+@dataclass
+class GitHubItem:
+    number: int
+    created_at: str
+    item: VerifiedItem
+    # Attachment links of the body, by file name
+    attachment_urls: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class Discrepancy:
+    kind: str
+    bb_id: int
+    gh_number: Optional[int]
+    problems: List[str]
+
+
+def parse_github_item(node: Dict[str, Any], is_pull: bool) -> GitHubItem:
+    return GitHubItem(
+        number=node["number"],
+        created_at=node["createdAt"],
+        item=VerifiedItem(
+            title=node["title"],
+            closed=node["state"] != "OPEN",
+            labels=sorted(label["name"] for label in node["labels"]["nodes"]),
+            is_pull=is_pull,
+            body_hash=hash_text(node["body"]),
+            comment_hashes=[hash_text(comment["body"]) for comment in node["comments"]["nodes"]],
+        ),
+        attachment_urls={match["name"]: match["url"] for match in ATTACHMENT_RE.finditer(node["body"] or "")},
+    )
+
+
+@dataclass
+class GitHubIndex:
+    """GitHub items by the id of their Bitbucket item"""
+
+    issues: Dict[int, GitHubItem] = field(default_factory=dict)
+    pulls: Dict[int, GitHubItem] = field(default_factory=dict)
+    # Issues without Bitbucket id in their title, by title and creation date
+    issues_by_title: Dict[Tuple[str, str], GitHubItem] = field(default_factory=dict)
+
+    def find_issue(self, bb_issue: BitbucketIssue) -> Optional[GitHubItem]:
+        return self.issues.get(bb_issue.id) or self.issues_by_title.get(
+            (bb_issue.title.strip(), convert_date(bb_issue.created_on))
+        )
+
+
+def index_github_items(gh_items: List[GitHubItem], keep_issue_numbers: bool) -> GitHubIndex:
+    index = GitHubIndex()
+    for gh_item in gh_items:
+        title = gh_item.item.title
+        if match := BB_PULL_TITLE_RE.match(title):
+            index.pulls[int(match["bb_id"])] = gh_item
+        elif match := BB_ISSUE_TITLE_RE.match(title):
+            index.issues[int(match["bb_id"])] = gh_item
+        elif gh_item.item.is_pull:
+            continue
+        elif keep_issue_numbers:
+            index.issues[gh_item.number] = gh_item
+        else:
+            index.issues_by_title[(title.strip(), gh_item.created_at)] = gh_item
+    return index
+
+
+def construct_verified_item(
+    bb_item: Union[BitbucketIssue, BitbucketPull], run_data: MigrationConfig, gh_item: GitHubItem, content: bool
+) -> VerifiedItem:
+    """
+    The item as the migration writes it, with the title trimmed as GitHub does. Without content, only what the
+    Bitbucket listings give is compared.
+    """
+    if isinstance(bb_item, BitbucketIssue):
+        if not content:
+            closed = map_bb_state_to_gh_state(bb_item) == "closed"
+            return VerifiedItem(bb_item.title.strip(), closed, construct_gh_issue_labels(bb_item), is_pull=False)
+        # The attachments are not uploaded again, the links of the GitHub body are used
+        data = construct_gh_issue_from_bb_issue(bb_item, run_data, {bb_item.id: gh_item.attachment_urls})
+        meta = data["issue"]
+        is_pull = False
+    else:
+        # As the migration does, the branches are only checked for the pull requests not migrated to pulls yet
+        is_pull = bb_pull_maps_gh_pull(bb_item, None if gh_item.item.is_pull else run_data.gh_branches)
+        if not content:
+            title = build_gh_title_from_bb_pull(bb_item).strip()
+            return VerifiedItem(title, bb_pull_is_closed(bb_item), construct_gh_pull_labels(bb_item), is_pull)
+        if is_pull:
+            data = construct_gh_pull_from_bb_pull(bb_item, run_data)
+            meta = data["pull"]
+        else:
+            data = construct_gh_issue_from_bb_pull(bb_item, run_data)
+            meta = data["issue"]
+    return VerifiedItem(
+        title=meta["title"].strip(),
+        closed=meta["closed"],
+        labels=sorted(meta["labels"]),
+        is_pull=is_pull,
+        body_hash=hash_text(meta["body"]),
+        comment_hashes=[hash_text(comment["body"]) for comment in data["comments"]],
+    )
+
+
+def compare_items(expected: VerifiedItem, actual: VerifiedItem) -> List[str]:
+    problems = []
+    if expected.is_pull != actual.is_pull:
+        problems.append(f"expected a {'pull request' if expected.is_pull else 'issue'}")
+    if expected.title != actual.title:
+        problems.append("title differs")
+    if expected.closed != actual.closed:
+        problems.append(f"expected {'closed' if expected.closed else 'open'}")
+    if expected.labels != actual.labels:
+        problems.append(f"labels {actual.labels} instead of {expected.labels}")
+    if expected.body_hash is not None and expected.body_hash != actual.body_hash:
+        problems.append("body differs")
+    if expected.comment_hashes is not None and actual.comment_hashes is not None:
+        if len(expected.comment_hashes) != len(actual.comment_hashes):
+            problems.append(f"{len(actual.comment_hashes)} comments instead of {len(expected.comment_hashes)}")
+        else:
+            differing = [
+                str(i + 1)
+                for i, (expected_hash, actual_hash) in enumerate(zip(expected.comment_hashes, actual.comment_hashes))
+                if expected_hash != actual_hash
+            ]
+            if differing:
+                problems.append(f"comments {', '.join(differing)} differ")
+    return problems
+
+
+def verify_repository(
+    bb_export: BitbucketExport,
+    gh_import: GithubImport,
+    keep_issue_numbers: bool = False,
+    comment_compaction: CommentCompaction = CommentCompaction.none,
+    local_clone: Optional[str] = None,
+    content: bool = False,
+    report_file: Optional[str] = None,
+) -> List[Discrepancy]:
+    """
+    Compare the Bitbucket issues and pull requests with their GitHub items, as a migration with the same options would
+    write them: titles, states and labels, and with content the hashes of the bodies and comments.
+    GitHub is read with a few GraphQL queries, Bitbucket with the same reads as a migration, concurrently.
+    """
+    bb_repo = bb_export.get_repo_full_name()
+    gh_repo = gh_import.get_repo_full_name()
+    run_data = MigrationConfig(
+        bb_repo=bb_repo,
+        bb_export=bb_export,
+        gh_repo=gh_repo,
+        gh_import=gh_import,
+        skip_attachments=False,
+        specific_issues=None,
+        specific_pulls=None,
+        update=False,
+        dry_run=True,
+        progress=ProgressTracker(
+            bb_repo, bb_calls_counter=lambda: bb_export.request_count, gh_rate_limit=gh_import.get_rate_limit_status
+        ),
+        keep_issue_numbers=keep_issue_numbers,
+        comment_compaction=comment_compaction,
+        git_objects=open_git_objects(local_clone) if local_clone else None,
+        links=LinkRewriter(bb_repo, {**config.KNOWN_REPO_MAPPING, bb_repo: gh_repo}, keep_issue_numbers),
+    )
+
+    print(f"Get all GitHub issues and pull requests of {gh_repo}...")
+    gh_issue_nodes, gh_pull_nodes = get_repository_items(gh_import.access_token, gh_repo, gh_import.session)
+    gh_items = [parse_github_item(node, is_pull=False) for node in gh_issue_nodes]
+    gh_items += [parse_github_item(node, is_pull=True) for node in gh_pull_nodes]
+    index = index_github_items(gh_items, keep_issue_numbers)
+    for bb_id, gh_item in index.issues.items():
+        run_data.links.add_number(ISSUE, bb_id, gh_item.number)
+    for bb_id, gh_item in index.pulls.items():
+        run_data.links.add_number(PULL, bb_id, gh_item.number)
+
+    bb_issues = bb_export.get_issues()
+    bb_pulls = list(bb_export.get_pulls(None))
+    if bb_pulls:
+        # Open pull requests whose branches are not in GitHub are migrated to issues
+        run_data.gh_branches = list_gh_branches(run_data)
+    print(f"Got {len(gh_items)} GitHub items, {len(bb_issues)} Bitbucket issues and {len(bb_pulls)} pull requests")
+
+    def verify(bb_item: Union[BitbucketIssue, BitbucketPull]) -> Optional[Discrepancy]:
+        if isinstance(bb_item, BitbucketIssue):
+            kind, gh_item = "issue", index.find_issue(bb_item)
+        else:
+            kind, gh_item = "pull", index.pulls.get(bb_item.id)
+        try:
+            if gh_item is None:
+                return Discrepancy(kind, bb_item.id, None, ["missing in GitHub"])
+            problems = compare_items(construct_verified_item(bb_item, run_data, gh_item, content), gh_item.item)
+            return Discrepancy(kind, bb_item.id, gh_item.number, problems) if problems else None
+        finally:
+            run_data.progress.advance()
+
+    run_data.progress.start_phase("verification", len(bb_issues) + len(bb_pulls))
+    bb_items: List[Union[BitbucketIssue, BitbucketPull]] = [*bb_issues, *bb_pulls]
+    with ThreadPoolExecutor(max_workers=bb_export.max_workers) as executor:
+        discrepancies = [discrepancy for discrepancy in executor.map(verify, bb_items) if discrepancy is not None]
+    run_data.progress.finish_phase()
+    if run_data.git_objects is not None:
+        run_data.git_objects.close()
+
+    print(f"Verification of Bitbucket repository '{bb_repo}' against GitHub repository '{gh_repo}':")
+    for discrepancy in discrepancies:
+        gh_number = f"GitHub #{discrepancy.gh_number}" if discrepancy.gh_number else "GitHub"
+        print(f"  Bitbucket {discrepancy.kind} #{discrepancy.bb_id} / {gh_number}: {'; '.join(discrepancy.problems)}")
+    print(f"  {len(discrepancies)} discrepancies on {len(bb_items)} items")
+    for kind, option in (("issue", "--specific-issues"), ("pull", "--specific-pulls")):
+        ids = [str(discrepancy.bb_id) for discrepancy in discrepancies if discrepancy.kind == kind]
+        if ids:
+            print(f"  To migrate them again: {' '.join(f'{option} {bb_id}' for bb_id in ids)}")
+
+    if report_file:
+        report = {
+            "repository": bb_repo,
+            "github_repository": gh_repo,
+            "items": len(bb_items),
+            "discrepancies": [asdict(discrepancy) for discrepancy in discrepancies],
+        }
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+    return discrepancies
+
+
+def main(
+    github_access_token: str = typer.Option(..., help="Github Access Token", envvar="GITHUB_ACCESS_TOKEN"),
+    bitbucket_repository: str = typer.Option(
+        ..., help="Full name of the Bitbucket repository (e.g. yourteamname/your-repo-name)"
+    ),
+    github_repository: str = typer.Option(
+        ..., help="Full name of the Github repository (e.g. yourorganizationanme/your-repo-name)"
+    ),
+    bitbucket_username: str = typer.Option(..., help="BitBucket username with access to repository"),
+    bitbucket_password: str = typer.Option(...),
+    concurrency: int = typer.Option(DEFAULT_POOL_SIZE, help="Concurrent requests, and kept-alive connections per host"),
+    keep_issue_numbers: bool = typer.Option(False, help="The migration kept the issue numbers"),
+    comment_compaction: CommentCompaction = typer.Option(
+        CommentCompaction.none, help="Comment compaction used by the migration"
+    ),
+    local_clone: Optional[str] = typer.Option(None, help="Local clone of the repository used by the migration"),
+    content: bool = typer.Option(
+        False,
+        help="Compare the bodies and comments too. This reads the comments, changes and attachments of each Bitbucket "
+        "item, like a migration: about 250 items per hour fit in the Bitbucket rate limit. Otherwise only titles, "
+        "states and labels are compared, from the listings.",
+    ),
+    report_file: Optional[str] = typer.Option(None, help="JSON file where the discrepancies are written"),
+) -> None:
+    """Verify that the Bitbucket issues and pull requests were migrated to GitHub"""
+    bb_export = BitbucketExport(
+        bitbucket_repository, username=bitbucket_username, app_password=bitbucket_password, max_workers=concurrency
+    )
+    gh_import = GithubImport(github_access_token, github_repository, debug=False, pool_size=concurrency)
+    discrepancies = verify_repository(
+        bb_export,
+        gh_import,
+        keep_issue_numbers=keep_issue_numbers,
+        comment_compaction=comment_compaction,
+        local_clone=local_clone,
+        content=content,
+        report_file=report_file,
+    )
+    if discrepancies:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from .bitbucket import BitbucketExport
+
+# Rough number of API calls needed to migrate an issue (comments, changes, attachments, import) and a pull request
+# (details, comments, activity, creation). The cost of a repository is expressed in calls.
+ISSUE_COST = 6
+PULL_COST = 8
+# The clone and push of the git repository, in calls per byte of repository
+GIT_BYTES_PER_CALL = 1000 * 1000
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class WorkspaceRepository:
+    bb_repo: str
+    gh_repo: str
+    size: int
+    issues: int
+    pulls: int
+    status: str = PENDING
+    attempts: int = 0
+    error: Optional[str] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def estimated_cost(self) -> int:
+        return self.issues * ISSUE_COST + self.pulls * PULL_COST + self.size // GIT_BYTES_PER_CALL
+
+
+class WorkspaceState:
+    """
+    Migration status of each repository of a workspace, persisted in a JSON file after each change,
+    so that a stopped workspace migration can be resumed. A read only state is loaded but never saved.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self.repositories: Dict[str, WorkspaceRepository] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for entry in json.load(f)["repositories"]:
+                    repository = WorkspaceRepository(**entry)
+                    if repository.status == RUNNING:
+                        # Interrupted by the end of the previous run
+                        repository.status = PENDING
+                    self.repositories[repository.bb_repo] = repository
+
+    def save(self) -> None:
+        if self.read_only:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write then rename so that an interruption never leaves a partial file
+        tmp_file = f"{self.path}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"repositories": [asdict(repository) for repository in self.repositories.values()]}, f, indent=2)
+        os.replace(tmp_file, self.path)
+
+    def update(self, repository: WorkspaceRepository, **changes) -> None:
+        with self._lock:
+            for key, value in changes.items():
+                setattr(repository, key, value)
+            self.save()
+
+
+def list_workspace_repositories(
+    bb_export: "BitbucketExport",
+    state: WorkspaceState,
+    map_repo: Callable[[str], str],
+    client_factory: Callable[[str], "BitbucketExport"],
+) -> List[WorkspaceRepository]:
+    """
+    List the repositories of the team of bb_export, with their size and number of issues and pull requests.
+    Repositories already in the state are kept as they are, only new ones are counted.
+    """
+    raw_repositories = bb_export.get_team_repositories()
+    new_repositories = [raw for raw in raw_repositories if raw["full_name"] not in state.repositories]
+    print(f"Got {len(raw_repositories)} Bitbucket repositories, {len(new_repositories)} not seen before")
+
+    def count(raw: Dict) -> WorkspaceRepository:
+        client = client_factory(raw["full_name"])
+        return WorkspaceRepository(
+            bb_repo=raw["full_name"],
+            gh_repo=map_repo(raw["full_name"]),
+            size=raw.get("size") or 0,
+            issues=client.get_issues_count() if raw.get("has_issues") else 0,
+            pulls=client.get_pulls_count(),
+        )
+
+    with ThreadPoolExecutor(max_workers=bb_export.max_workers) as executor:
+        for repository in executor.map(count, new_repositories):
+            state.repositories[repository.bb_repo] = repository
+    state.save()
+    return [state.repositories[raw["full_name"]] for raw in raw_repositories]
+
+
+def migrate_workspace(
+    repositories: List[WorkspaceRepository],
+    migrate: Callable[[WorkspaceRepository], None],
+    state: WorkspaceState,
+    parallelism: int,
+) -> None:
+    """
+    Migrate the repositories which are not done yet, parallelism at a time.
+    The most expensive repositories are started first, so that the last ones to finish are small ones and the
+    whole migration ends as early as possible. A failed repository does not stop the others, it is retried on resume.
+    """
+    queue = sorted(
+        [repository for repository in repositories if repository.status != DONE],
+        key=lambda repository: repository.estimated_cost,
+        reverse=True,
+    )
+    print(
+        f"Migrating {len(queue)} repositories ({len(repositories) - len(queue)} already done), "
+        f"{parallelism} at a time, largest first"
+    )
+    for repository in queue:
+        print(
+            f"  {repository.bb_repo} -> {repository.gh_repo}: {repository.issues} issues, {repository.pulls} pulls, "
+            f"{repository.size} bytes, estimated cost {repository.estimated_cost}"
+        )
+
+    def run(repository: WorkspaceRepository) -> None:
+        state.update(repository, status=RUNNING, attempts=repository.attempts + 1, started_at=time.time(), error=None)
+        try:
+            migrate(repository)
+        except Exception as e:
+            traceback.print_exc()
+            print(f"Error: migration of {repository.bb_repo} failed, it will be retried on the next run")
+            state.update(repository, status=FAILED, error=repr(e), finished_at=time.time())
+        else:
+            state.update(repository, status=DONE, finished_at=time.time())
+
+    # The executor starts the submitted repositories in order, each time a worker is free
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="workspace") as executor:
+        executor.map(run, queue)
+
+    failed = [repository.bb_repo for repository in queue if repository.status == FAILED]
+    if failed:
+        print(f"Failed repositories: {', '.join(failed)}")